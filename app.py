@@ -4,23 +4,109 @@ import sys
 import os
 import logging
 import time
+import signal
+import threading
 import json
-from pprint import pprint
+import copy
+import heapq
+import re
+import importlib.util
+from collections import namedtuple
+import concurrent.futures
 from datetime import datetime, timedelta
 from xml.etree import ElementTree
-from xml.dom import minidom
 # end stdlib
-import requests
-import pytz
-from PIL import Image,ImageDraw,ImageFont
-import epd5in65f
-# exceptions
-from requests.exceptions import ConnectionError
+
+def lazy_import(name):
+    # The module is only executed on first attribute access, so startup
+    # (and the environment checks in main) do not pay for it up front.
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+requests = lazy_import('requests')
+pytz = lazy_import('pytz')
+ImageDraw = lazy_import('PIL.ImageDraw')
+epd5in65f = lazy_import('epd5in65f')
+httppool = lazy_import('httppool')
+hass = lazy_import('hass')
+jsonstream = lazy_import('jsonstream')
+fonts = lazy_import('fonts')
+layout = lazy_import('layout')
+plexsessions = lazy_import('plexsessions')
+responsecache = lazy_import('responsecache')
+breaker = lazy_import('breaker')
+import epdworker
 
 APP_NAME = 'epaper'
 DEBUG = False
-MAX_WIDTH = 22
+FONT_PATH = 'Font.ttc'
+FONT_SIZE = 18
+# Text is cut to end TEXT_MARGIN pixels short of its tile's right edge
+TEXT_MARGIN = 4
+# Dashboard tiles: name, bbox (right and bottom exclusive), outline color
+# and the EPC fields that EPC.render_<name> draws. A tile lists the status
+# field of every source it shows data from, to mark it when one is DOWN.
+TILES = (
+    ('weather', (0, 0, 200, 220), 'ORANGE', (
+        'weather_status', 'sensors_status', 'next_dawn', 'next_dusk', 'weather', 'weather_temperature', 'weather_humidity',
+        'today_high_temp', 'today_low_temp', 'tomorrow_high_temp', 'tomorrow_low_temp',
+        'plus_2_high_temp', 'plus_2_low_temp', 'plus_3_high_temp', 'plus_3_low_temp',
+        'weather_uv_index', 'weather_pressure', 'weather_wind')),
+    ('printer', (200, 0, 400, 220), 'GREEN', (
+        'sensors_status', 'printer_black_toner', 'printer_cyan_toner', 'printer_magenta_toner', 'printer_yellow_toner',
+        'router_status', 'router_updates', 'roomba_status', 'roomba_battery', 'roomba_bin_full', 'holiday')),
+    ('downloaders', (400, 0, 600, 220), 'BLUE', (
+        'sensors_status', 'sab_status', 'sab_queue', 'sab_speed', 'sab_speedlimit', 'deluge_status',
+        'deluge_download_speed', 'deluge_upload_speed', 'nas_free_disk')),
+    ('laundry', (0, 220, 200, 448), 'BLUE', (
+        'sensors_status', 'washer_switch', 'washer_1min', 'washer_1mon', 'washer_cost_1mon', 'washer_done_last_fired',
+        'dryer_switch', 'dryer_1min', 'dryer_1mon', 'dryer_cost_1mon', 'dryer_done_last_fired')),
+    ('plex', (200, 220, 400, 448), 'RED', (
+        'plex_status', 'plex_streams', 'plex_new_movies', 'plex_new_episodes')),
+    ('air', (400, 220, 600, 448), 'YELLOW', (
+        'sensors_status', 'air_detector_battery', 'air_detector_temperature', 'air_detector_humidity',
+        'air_detector_carbon_dioxide', 'air_detector_formaldehyde', 'air_detector_vocs',
+        'air_detector_pm2_5')),
+)
 poll_world_weather = True
+# (connect, read) timeout in seconds for every HTTP request
+HTTP_TIMEOUT = (3.05, 10)
+# Kept-alive connections per host, and retries for failed requests
+HTTP_POOL_SIZE = 4
+HTTP_RETRIES = 2
+# New movies and episodes listed from the Plex library
+PLEX_RECENT_COUNT = 3
+# A source is skipped after this many failures in a row, for a backoff that
+# starts at the base delay and doubles (up to the max) while it stays down
+BREAKER_FAILURES = 1
+BREAKER_BASE_DELAY = 60
+BREAKER_MAX_DELAY = 3600
+# Last line of the firmware log that counts the pending updates
+ROUTER_UPDATES_PATTERN = re.compile(r'(\d+) package\(s\) will be affected')
+# Seconds a cached response stays fresh, for how long after that it is
+# still shown while a newer copy is fetched in the background, and for how
+# much longer still it stands in for a source that fails
+CACHE_TTLS = {
+    'worldweather': (3 * 3600, 21 * 3600, 24 * 3600),
+    'router': (3600, 6 * 3600, 0),
+    'plex_library': (600, 3600, 0),
+}
+CACHE_MAX_ENTRIES = 32
+# Bytes read at a time when streaming /api/states
+STATES_CHUNK_SIZE = 16 * 1024
+# Seconds each source gets to finish before the render goes on without it
+SOURCE_DEADLINES = {
+    'worldweather': 15,
+    'router': 10,
+    'plex': 15,
+    'sensors': 15,
+}
 
 format = "%(asctime)s [" + APP_NAME + "] %(levelname)s %(message)s"
 datefmt = "[%Y-%m-%dT%H:%M:%S]"
@@ -77,6 +163,209 @@ def calc_wind_arrow(bearing):
     elif dir == 'Southwest':
         return '\u2199'
 
+# Home Assistant entities the dashboard reads. Each entity_id maps to an
+# Entity whose parse(epc, item) stores the fields draw() needs, and which
+# lists the attributes it reads from the state object.
+Entity = namedtuple('Entity', 'parse attributes')
+
+def state_field(field, suffix=''):
+    def parse(epc, item):
+        setattr(epc, field, item['state'] + suffix)
+    return Entity(parse, ())
+
+def unit_field(field):
+    def parse(epc, item):
+        setattr(epc, field, item['state'] + item['attributes']['unit_of_measurement'])
+    return Entity(parse, ('unit_of_measurement',))
+
+def percent_field(field):
+    def parse(epc, item):
+        setattr(epc, field, str(int(float(item['state']))) + '%')
+    return Entity(parse, ())
+
+def floored_field(field, unit):
+    def parse(epc, item):
+        rounded_reading = float(item['state']) // 1
+        setattr(epc, field, str(rounded_reading) + unit)
+    return Entity(parse, ())
+
+def monthly_energy_field(field, cost_field):
+    def parse(epc, item):
+        rounded_reading = float(item['state']) // 1
+        setattr(epc, field, str(rounded_reading) + 'KWh')
+        setattr(epc, cost_field, "$" + str(round(rounded_reading * 0.092, 2)))
+    return Entity(parse, ())
+
+def clock_field(field):
+    def parse(epc, item):
+        chicago_time = convert_to_central_time(item['state'])
+        setattr(epc, field, chicago_time.isoformat().split('T')[1].split('-')[0])
+    return Entity(parse, ())
+
+def last_triggered_field(field):
+    def parse(epc, item):
+        chicago_time = convert_to_central_time(item['attributes']['last_triggered'])
+        setattr(epc, field, chicago_time.isoformat().split('.')[0])
+    return Entity(parse, ('last_triggered',))
+
+def parse_weather(epc, item):
+    attributes = item['attributes']
+    epc.weather = item['state']
+    epc.weather_temperature = str(attributes['temperature']) + attributes['temperature_unit']
+    epc.weather_humidity = str(attributes['humidity']) + '%'
+    epc.weather_uv_index = attributes['uv_index']
+    epc.weather_pressure = str(attributes['pressure']) + attributes['pressure_unit']
+    wind_speed = str(attributes['wind_speed']) + attributes['wind_speed_unit']
+    wind_arrow = calc_wind_arrow(int(attributes['wind_bearing']))
+    epc.weather_wind = wind_speed + ' ' + wind_arrow + str(int(attributes['wind_bearing']))
+
+def parse_sab_speed(epc, item):
+    speed = str(round(float(item['state']), 1))
+    unit = item['attributes']['unit_of_measurement']
+    epc.sab_speed = f'{speed} {unit}'
+
+def parse_sab_total_disk(epc, item):
+    epc.sab_total_disk = round(float(item['state']) / 1000, 2)
+
+def parse_sab_free_disk(epc, item):
+    epc.sab_free_disk = round(float(item['state']) / 1000, 2)
+
+def parse_holiday(epc, item):
+    holiday = item['attributes']['message']
+    holiday_start = item['attributes']['start_time']
+    epc.holiday = None
+    if epc.today_date == holiday_start.split(' ')[0]:
+        epc.holiday = f"* {holiday} *"
+
+def parse_roomba(epc, item):
+    epc.roomba_status = item['state']
+    epc.roomba_battery = str(item['attributes']['battery_level']) + '%'
+    epc.roomba_bin_full = item['attributes']['bin_full']
+
+ENTITIES = {
+    'sun.sun':                                                  state_field('sun_status'),
+    'sensor.sun_next_rising':                                   clock_field('next_dawn'),
+    'sensor.sun_next_setting':                                  clock_field('next_dusk'),
+    'weather.forecast_home':                                    Entity(parse_weather, (
+        'temperature', 'temperature_unit', 'humidity', 'uv_index', 'pressure',
+        'pressure_unit', 'wind_speed', 'wind_speed_unit', 'wind_bearing')),
+    'sensor.air_detector_battery':                              percent_field('air_detector_battery'),
+    'sensor.air_detector_carbon_dioxide':                       unit_field('air_detector_carbon_dioxide'),
+    'sensor.air_detector_formaldehyde':                         unit_field('air_detector_formaldehyde'),
+    'sensor.air_detector_humidity':                             percent_field('air_detector_humidity'),
+    'sensor.air_detector_pm2_5':                                unit_field('air_detector_pm2_5'),
+    'sensor.air_detector_temperature':                          unit_field('air_detector_temperature'),
+    'sensor.air_detector_vocs':                                 unit_field('air_detector_vocs'),
+    'switch.switch_washer':                                     state_field('washer_switch'),
+    'sensor.washer_1min':                                       floored_field('washer_1min', 'W'),
+    'sensor.washer_1mon':                                       monthly_energy_field('washer_1mon', 'washer_cost_1mon'),
+    'switch.switch_dryer':                                      state_field('dryer_switch'),
+    'sensor.dryer_1min':                                        floored_field('dryer_1min', 'W'),
+    'sensor.dryer_1mon':                                        monthly_energy_field('dryer_1mon', 'dryer_cost_1mon'),
+    'sensor.beastnas_plex':                                     state_field('plex_stream_count'),
+    'sensor.sabnzbd_status':                                    state_field('sab_status'),
+    'number.sabnzbd_speedlimit':                                state_field('sab_speedlimit'),
+    'sensor.sabnzbd_speed':                                     Entity(parse_sab_speed, ('unit_of_measurement',)),
+    'sensor.sabnzbd_queue_count':                               state_field('sab_queue'),
+    'sensor.sabnzbd_total_disk_space':                          Entity(parse_sab_total_disk, ()),
+    'sensor.sabnzbd_free_disk_space':                           Entity(parse_sab_free_disk, ()),
+    'sensor.deluge_download_speed':                             unit_field('deluge_download_speed'),
+    'sensor.deluge_upload_speed':                               unit_field('deluge_upload_speed'),
+    'sensor.deluge_status':                                     state_field('deluge_status'),
+    'sensor.canon_lbp632c_canon_cartridge_067_black_toner':     state_field('printer_black_toner', '%'),
+    'sensor.canon_lbp632c_canon_cartridge_067_cyan_toner':      state_field('printer_cyan_toner', '%'),
+    'sensor.canon_lbp632c_canon_cartridge_067_magenta_to':      state_field('printer_magenta_toner', '%'),
+    'sensor.canon_lbp632c_canon_cartridge_067_yellow_ton':      state_field('printer_yellow_toner', '%'),
+    'switch.main_tv':                                           state_field('main_tv_status'),
+    'switch.fan':                                               state_field('fan_switch'),
+    'switch.living_room_nw_corner':                             state_field('living_room_lights_nw_corner'),
+    'switch.living_room_sw_corner':                             state_field('living_room_lights_sw_corner'),
+    'switch.air_filter':                                        state_field('air_filter'),
+    'automation.notify_when_laundry_washer_is_done':            last_triggered_field('washer_done_last_fired'),
+    'automation.notify_when_laundry_dryer_is_done':             last_triggered_field('dryer_done_last_fired'),
+    'calendar.united_states_mo':                                Entity(parse_holiday, ('message', 'start_time')),
+    'vacuum.roomba':                                            Entity(parse_roomba, ('battery_level', 'bin_full')),
+}
+
+def resolve_nas_free_disk(epc):
+    if hasattr(epc, 'sab_free_disk') and hasattr(epc, 'sab_total_disk'):
+        epc.nas_free_disk = f'{epc.sab_free_disk}/{epc.sab_total_disk}TB'
+
+# Fields built from more than one entity, filled in once the scan is done
+RESOLVERS = (
+    resolve_nas_free_disk,
+)
+
+# Jinja template for Home Assistant's /api/template that renders the
+# ENTITIES, with only the attributes each one lists, as a JSON list shaped
+# like /api/states. Entities Home Assistant does not know are left out.
+def states_template(entities):
+    lines = ['{%- set ns = namespace(states=[]) %}']
+    for entity_id, entity in entities.items():
+        attributes = ', '.join(f"'{name}': s.attributes.get('{name}')" for name in entity.attributes)
+        lines.append(
+            f"{{%- set s = states['{entity_id}'] %}}{{% if s is not none %}}"
+            f"{{% set ns.states = ns.states + [{{'entity_id': s.entity_id, 'state': s.state, "
+            f"'attributes': {{{attributes}}}}}] %}}{{% endif %}}")
+    lines.append('{{ ns.states | to_json }}')
+    return '\n'.join(lines)
+
+STATES_TEMPLATE = states_template(ENTITIES)
+
+# Seconds since the epoch kept in a small file, 0 if there is none
+def read_stamp(path):
+    if not path:
+        return 0
+    try:
+        with open(os.path.expanduser(path)) as f:
+            return float(f.read().strip())
+    except (OSError, ValueError):
+        return 0
+
+def write_stamp(path, stamp):
+    if not path:
+        return
+    path = os.path.expanduser(path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(str(stamp))
+    os.replace(tmp_path, path)
+
+# Yield parse(element) for each item of a Plex MediaContainer read from
+# stream, clearing elements as soon as they are done with.
+def iter_plex_items(stream, parse):
+    depth = 0
+    root = None
+    for event, element in ElementTree.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if root is None:
+                root = element
+            continue
+        depth -= 1
+        if depth == 1:
+            yield parse(element)
+            element.clear()
+            root.clear()
+
+def parse_plex_episode(item):
+    new_episode = {}
+    new_episode['season_name'] = item.attrib['parentTitle'].replace('Season ', 'S')
+    new_episode['episode_number'] = item.attrib['index']
+    if 'updatedAt' in item.attrib.keys():
+        new_episode['epoch_updated'] = item.attrib['updatedAt']
+    new_episode['epoch_added'] = item.attrib['addedAt']
+    new_episode['show_name'] = item.attrib['grandparentTitle']
+    return new_episode
+
+def parse_plex_movie(item):
+    new_movie = {}
+    new_movie['title'] = item.attrib['title']
+    new_movie['year'] = item.attrib['year']
+    new_movie['epoch_added'] = item.attrib['addedAt']
+    return new_movie
+
 def main():
     HA_TOKEN = os.getenv('HA_TOKEN')
     if not HA_TOKEN:
@@ -99,38 +388,166 @@ def main():
         print('App cannot start without a ROUTER_SECRET.')
         exit(1)
 
-    epc = EPC()
+    FRAME_CACHE = os.getenv('FRAME_CACHE', '~/.cache/epaper/last_frame')
+    CACHE_DIR = os.getenv('CACHE_DIR', '~/.cache/epaper/http')
+    BREAKER_STATE = os.getenv('BREAKER_STATE', '~/.cache/epaper/breakers.json')
+    ROUTER_CHECK_STAMP = os.getenv('ROUTER_CHECK_STAMP', '~/.cache/epaper/router_check')
+    ROUTER_CHECK_INTERVAL = int(os.getenv('ROUTER_CHECK_INTERVAL', '21600'))
+    FORCE_REFRESH = os.getenv('FORCE_REFRESH', '') not in ('', '0')
+    DAEMON = os.getenv('DAEMON', '') not in ('', '0')
+    HA_WEBSOCKET = os.getenv('HA_WEBSOCKET', '') not in ('', '0')
+    HA_TEMPLATE = os.getenv('HA_TEMPLATE', '') not in ('', '0')
+    PLEX_WEBSOCKET = os.getenv('PLEX_WEBSOCKET', '') not in ('', '0')
+    REFRESH_INTERVAL = int(os.getenv('REFRESH_INTERVAL', '900'))
+
+    epc = EPC(FRAME_CACHE, FORCE_REFRESH, keep_open=DAEMON, ha_template=HA_TEMPLATE, cache_dir=CACHE_DIR,
+              breaker_state=BREAKER_STATE, router_check_stamp=ROUTER_CHECK_STAMP,
+              router_check_interval=ROUTER_CHECK_INTERVAL)
+    tokens = (HA_TOKEN, PLEX_TOKEN, WEATHER_TOKEN, ROUTER_KEY, ROUTER_SECRET)
+    if HA_WEBSOCKET:
+        epc.start_hass_stream(HA_TOKEN)
+    if PLEX_WEBSOCKET:
+        epc.start_plex_sessions(PLEX_TOKEN)
+
+    if DAEMON:
+        run_daemon(epc, REFRESH_INTERVAL, *tokens)
+        return
 
     try:
-#        while True:
-            log.info('Application started. Refreshing sensor data.')
-            #epc.refresh_worldweather(WEATHER_TOKEN)
-            epc.refresh_router_updates(ROUTER_KEY, ROUTER_SECRET)
-            epc.refresh_plex(PLEX_TOKEN, HA_TOKEN)
-            epc.refresh_sensors(HA_TOKEN)
-
-            log.info('Sensor data fetched. Initializing screen.')
-            epc.init_screen()
-
-            log.info('Screen initialized. Starting screen draw.')
-            epc.draw()
-            log.info('Screen draw complete. Goodbye.')
-#            log.info('Screen draw complete, sleeping until next cycle.')
-#            time.sleep(900)
+        log.info('Application started. Refreshing sensor data.')
+        run_cycle(epc, *tokens).result()
+        log.info('Screen draw complete. Goodbye.')
 
     except IOError as e:
         log.info(e)
 
     except KeyboardInterrupt:
         log.info("ctrl-c detected, cleaning up...")
-        epd5in65f.epdconfig.module_exit(cleanup=True)
+        epc.shutdown()
         exit()
 
+def run_cycle(epc, HA_TOKEN, PLEX_TOKEN, WEATHER_TOKEN, ROUTER_KEY, ROUTER_SECRET):
+    epc.refresh_dates()
+    sources = []
+    if poll_world_weather:
+        sources.append(('worldweather', EPC.refresh_worldweather, (WEATHER_TOKEN,), 'weather_status'))
+    sources.append(('router', EPC.refresh_router_updates, (ROUTER_KEY, ROUTER_SECRET), 'router_status'))
+    sources.append(('plex', EPC.refresh_plex, (PLEX_TOKEN,), 'plex_status'))
+    sources.append(('sensors', EPC.refresh_sensors, (HA_TOKEN,), 'sensors_status'))
+    outages = fetch_sources(epc, sources)
+    if 'plex' in outages:
+        epc.say_plex_is_down(HA_TOKEN)
+
+    for host, stats in epc.http.stats().items():
+        log.info(f"HTTP {host}: {stats['requests']} requests, {stats['connections']} connections, {stats['reused']} reused")
+
+    log.info('Sensor data fetched. Starting screen draw.')
+    return epc.draw()
+
+def fetch_sources(epc, sources):
+    # Run every (name, method, args, status_attr) source at once, each on
+    # its own copy of epc. Results are copied back only for sources that
+    # finish within their deadline, so a straggler cannot change the state
+    # halfway through the render. A source that misses its deadline or
+    # fails keeps its last values, and its status_attr goes DOWN, which the
+    # tiles showing those values mark as stale.
+    # Sources whose breaker is open are not run at all. Returns the names of
+    # the sources whose outage started this cycle.
+    start = time.monotonic()
+    before = dict(epc.__dict__)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix='fetch')
+    pending = []
+    outages = []
+    for name, method, args, status_attr in sources:
+        if not epc.breakers[name].allow():
+            log.info(f'{name} is known to be down, skipping it.')
+            setattr(epc, status_attr, 'DOWN')
+            continue
+        scratch = copy.copy(epc)
+        pending.append((name, status_attr, scratch, executor.submit(method, scratch, *args)))
+    executor.shutdown(wait=False)
+
+    for name, status_attr, scratch, future in pending:
+        deadline = SOURCE_DEADLINES[name]
+        try:
+            future.result(timeout=max(start + deadline - time.monotonic(), 0))
+        except concurrent.futures.TimeoutError:
+            log.warning(f'{name} missed its {deadline}s deadline, using its last known state.')
+        except Exception as e:
+            log.error(f'{name} failed after {time.monotonic() - start:.2f}s: {e!r}')
+        else:
+            log.info(f'{name} fetched in {time.monotonic() - start:.2f}s.')
+            for attr, value in scratch.__dict__.items():
+                if attr not in before or before[attr] is not value:
+                    setattr(epc, attr, value)
+            # A source that handles its own errors reports them as DOWN
+            if getattr(epc, status_attr) != 'DOWN':
+                epc.breakers[name].record_success()
+                continue
+        setattr(epc, status_attr, 'DOWN')
+        if epc.breakers[name].record_failure():
+            outages.append(name)
+
+    epc.breakers.save()
+    return outages
+
+def run_daemon(epc, interval, *tokens):
+    # Keep the process, and with it the open SPI handle and GPIO pins, alive
+    # between cycles. The panel sits in deep sleep while we wait.
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        log.info(f'Received {signal.Signals(signum).name}, shutting down.')
+        stop.set()
+        epc.dirty.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    log.info(f'Daemon started, refreshing every {interval} seconds.')
+    try:
+        while not stop.is_set():
+            epc.dirty.clear()
+            try:
+                run_cycle(epc, *tokens)
+            except Exception as e:
+                log.exception(f'Refresh cycle failed: {e}')
+            # A change pushed by a listener starts the next cycle early
+            if epc.dirty.wait(interval) and not stop.is_set():
+                log.info('Dashboard marked dirty, refreshing early.')
+    finally:
+        epc.shutdown()
+        log.info('Screen powered off. Goodbye.')
+
 class EPC:
-    def __init__(self):
-        self.epd = epd5in65f.EPD()
+    def __init__(self, frame_cache=None, force_refresh=False, keep_open=False, ha_template=False, cache_dir=None,
+                 breaker_state=None, router_check_stamp=None, router_check_interval=21600):
+        if frame_cache:
+            frame_cache = epd5in65f.FrameCache(frame_cache)
+        self.epd = epd5in65f.EPD(frame_cache=frame_cache, keep_open=keep_open)
+        self.worker = epdworker.DisplayWorker(self.epd)
+        self.layout = layout.Layout((self.epd.width, self.epd.height), [
+            layout.Tile(name, bbox, getattr(self.epd, color), fields, getattr(self, 'render_' + name))
+            for name, bbox, color, fields in TILES], margin=TEXT_MARGIN)
+        self.force_refresh = force_refresh
+        self.http = httppool.SessionPool(pool_maxsize=HTTP_POOL_SIZE, retries=HTTP_RETRIES, timeout=HTTP_TIMEOUT)
+        self.cache = responsecache.ResponseCache(cache_dir, max_entries=CACHE_MAX_ENTRIES)
+        self.breakers = breaker.Breakers(breaker_state, failure_threshold=BREAKER_FAILURES,
+                                         base_delay=BREAKER_BASE_DELAY, max_delay=BREAKER_MAX_DELAY)
+        self.HA_API = 'https://mccormicom.com:8123/'
+        self.ha_template = ha_template
         self.PLEX_API = 'http://mccormicom.com:32400/'
+        self.ROUTER_API = 'https://router.mccormicom.com/'
+        self.router_check_interval = router_check_interval
+        self.router_check_stamp = router_check_stamp
+        # Shared with the fetch copies, the firmware check updates it in place
+        self.router_check = {'last_run': read_stamp(router_check_stamp), 'result': None}
+        self.router_check_lock = threading.Lock()
+        self.hass_stream = None
+        self.plex_sessions = None
+        self.dirty = threading.Event()
         self.holiday = None
+        self.clock_box = None
 
     def init_screen(self):
         self.epd.init()
@@ -139,7 +556,30 @@ class EPC:
         self.epd.Clear()
 
     def shutdown(self):
-        epd5in65f.epdconfig.module_exit(cleanup=True)
+        # Let a refresh in progress finish, then power the panel down
+        self.worker.close()
+        self.epd.shutdown()
+        if self.hass_stream is not None:
+            self.hass_stream.stop()
+        if self.plex_sessions is not None:
+            self.plex_sessions.stop()
+        self.http.close()
+
+    # Follow the dashboard's entities over the Home Assistant websocket,
+    # refresh_sensors then reads them from memory instead of /api/states.
+    def start_hass_stream(self, HA_TOKEN):
+        url = self.HA_API.replace('https://', 'wss://').replace('http://', 'ws://') + 'api/websocket'
+        self.hass_stream = hass.HassStream(url, HA_TOKEN, ENTITIES, lambda: self.fetch_states(HA_TOKEN))
+        self.hass_stream.start()
+
+    # Follow Plex sessions over its notification websocket. refresh_plex then
+    # takes the now playing list from it, and a change to that list marks
+    # the dashboard dirty.
+    def start_plex_sessions(self, PLEX_TOKEN):
+        url = self.PLEX_API.replace('https://', 'wss://').replace('http://', 'ws://') + ':/websockets/notifications'
+        self.plex_sessions = plexsessions.PlexSessions(url, PLEX_TOKEN, lambda: self.fetch_plex_streams(PLEX_TOKEN),
+                                                       on_change=self.dirty.set)
+        self.plex_sessions.start()
 
     def say_plex_is_down(self, HA_TOKEN):
         now = datetime.now()
@@ -149,165 +589,109 @@ class EPC:
             "Authorization": f"Bearer {HA_TOKEN}",
             "content-type": "application/json"
         }
-        url = 'https://mccormicom.com:8123/api/webhook/plex-is-down-hJ4w0G1gjCMM-XwdCSGYv8d1'
-        req = requests.request('GET', url=url)
+        url = self.HA_API + 'api/webhook/plex-is-down-hJ4w0G1gjCMM-XwdCSGYv8d1'
+        try:
+            req = self.http.get(url)
+        except requests.RequestException as e:
+            log.error(f'Could not send the Plex down webhook: {e!r}')
 
     def refresh_sensors(self, HA_TOKEN):
+        self.sensors_status = 'HEALTHY'
+        if self.hass_stream is not None and self.hass_stream.synced.is_set():
+            self.apply_states(self.hass_stream.snapshot())
+        else:
+            self.apply_states(self.fetch_states(HA_TOKEN))
+
+    def fetch_states(self, HA_TOKEN):
         headers = {
             "Authorization": f"Bearer {HA_TOKEN}",
             "content-type": "application/json"
         }
 
-        url = 'https://mccormicom.com:8123/api/states'
-        req = requests.request('GET', url=url, headers=headers)
-
-        state_list = json.loads(req.text)
-        for item in state_list:
-            if item['entity_id'] == 'sun.sun':
-                self.sun_status = item['state']
-            if item['entity_id'] == 'sensor.sun_next_rising':
-                chicago_time = convert_to_central_time(item['state'])
-                next_dawn = chicago_time.isoformat().split('T')[1].split('-')[0]
-                self.next_dawn = next_dawn
-            if item['entity_id'] == 'sensor.sun_next_setting':
-                chicago_time = convert_to_central_time(item['state'])
-                next_dusk = chicago_time.isoformat().split('T')[1].split('-')[0]
-                self.next_dusk = next_dusk
-            if item['entity_id'] == 'weather.forecast_home':
-                self.weather = item['state']
-                temperat = str(item['attributes']['temperature']) + item['attributes']['temperature_unit']
-                self.weather_temperature = temperat
-                self.weather_humidity = str(item['attributes']['humidity']) + '%'
-                self.weather_uv_index = item['attributes']['uv_index']
-                pressure = str(item['attributes']['pressure']) + item['attributes']['pressure_unit']
-                self.weather_pressure = pressure
-                wind_speed = str(item['attributes']['wind_speed']) + item['attributes']['wind_speed_unit']
-                wind_arrow = calc_wind_arrow(int(item['attributes']['wind_bearing']))
-                wind = wind_speed + ' ' + wind_arrow + str(int(item['attributes']['wind_bearing']))
-                self.weather_wind = wind
-            if item['entity_id'] == 'sensor.air_detector_battery':
-                self.air_detector_battery = str(int(float(item['state']))) + '%'
-            if item['entity_id'] == 'sensor.air_detector_carbon_dioxide':
-                self.air_detector_carbon_dioxide = item['state'] + item['attributes']['unit_of_measurement']
-            if item['entity_id'] == 'sensor.air_detector_formaldehyde':
-                self.air_detector_formaldehyde = item['state'] + item['attributes']['unit_of_measurement']
-            if item['entity_id'] == 'sensor.air_detector_humidity':
-                self.air_detector_humidity = str(int(float(item['state']))) + '%'
-            if item['entity_id'] == 'sensor.air_detector_pm2_5':
-                self.air_detector_pm2_5 = item['state'] + item['attributes']['unit_of_measurement']
-            if item['entity_id'] == 'sensor.air_detector_temperature':
-                self.air_detector_temperature = item['state'] + item['attributes']['unit_of_measurement']
-            if item['entity_id'] == 'sensor.air_detector_vocs':
-                self.air_detector_vocs = item['state'] + item['attributes']['unit_of_measurement']
-            if item['entity_id'] == 'switch.switch_washer':
-                self.washer_switch = item['state']
-            if item['entity_id'] == 'sensor.washer_1min':
-                rounded_reading = float(item['state']) // 1
-                self.washer_1min = str(rounded_reading) + 'W'
-            if item['entity_id'] == 'sensor.washer_1mon':
-                rounded_reading = float(item['state']) // 1
-                self.washer_1mon = str(rounded_reading) + 'KWh'
-                washer_cost = round(rounded_reading * 0.092, 2)
-                self.washer_cost_1mon = "$" + str(washer_cost)
-            if item['entity_id'] == 'sensor.washer_1mon':
-                rounded_reading = float(item['state']) // 1
-                self.washer_1mon = str(rounded_reading) + 'KWh'
-            if item['entity_id'] == 'switch.switch_dryer':
-                self.dryer_switch = item['state']
-            if item['entity_id'] == 'sensor.dryer_1min':
-                rounded_reading = float(item['state']) // 1
-                self.dryer_1min = str(rounded_reading) + 'W'
-            if item['entity_id'] == 'sensor.dryer_1mon':
-                rounded_reading = float(item['state']) // 1
-                self.dryer_1mon = str(rounded_reading) + 'KWh'
-                dryer_cost = round(rounded_reading * 0.092, 2)
-                self.dryer_cost_1mon = "$" + str(dryer_cost)
-            if item['entity_id'] == 'sensor.beastnas_plex':
-                self.plex_stream_count = item['state']
-            if item['entity_id'] == 'sensor.sabnzbd_status':
-                self.sab_status = item['state']
-            if item['entity_id'] == 'number.sabnzbd_speedlimit':
-                self.sab_speedlimit = item['state']
-            if item['entity_id'] == 'sensor.sabnzbd_speed':
-                speed = str(round(float(item['state']), 1))
-                unit = item['attributes']['unit_of_measurement']
-                self.sab_speed = f'{speed} {unit}'
-            if item['entity_id'] == 'sensor.sabnzbd_queue_count':
-                self.sab_queue = item['state']
-            if item['entity_id'] == 'sensor.sabnzbd_total_disk_space':
-                total_disk = round(float(item['state']) / 1000, 2)
-                self.sab_total_disk = total_disk
-            if item['entity_id'] == 'sensor.sabnzbd_free_disk_space':
-                rounded_reading = round(float(item['state']) / 1000, 2)
-                rounded_reading_str = str(rounded_reading)
-                total_disk_str = str(self.sab_total_disk)
-                self.nas_free_disk = f'{rounded_reading_str}/{total_disk_str}TB'
-            if item['entity_id'] == 'sensor.deluge_download_speed':
-                self.deluge_download_speed = item['state'] + item['attributes']['unit_of_measurement']
-            if item['entity_id'] == 'sensor.deluge_upload_speed':
-                self.deluge_upload_speed = item['state'] + item['attributes']['unit_of_measurement']
-            if item['entity_id'] == 'sensor.deluge_status':
-                self.deluge_status = item['state']
-            if item['entity_id'] == 'sensor.canon_lbp632c_canon_cartridge_067_black_toner':
-                self.printer_black_toner = item['state'] + '%'
-            if item['entity_id'] == 'sensor.canon_lbp632c_canon_cartridge_067_cyan_toner':
-                self.printer_cyan_toner = item['state'] + '%'
-            if item['entity_id'] == 'sensor.canon_lbp632c_canon_cartridge_067_magenta_to':
-                self.printer_magenta_toner = item['state'] + '%'
-            if item['entity_id'] == 'sensor.canon_lbp632c_canon_cartridge_067_yellow_ton':
-                self.printer_yellow_toner = item['state'] + '%'
-            if item['entity_id'] == 'switch.main_tv':
-                self.main_tv_status = item['state']
-            if item['entity_id'] == 'switch.fan':
-                self.fan_switch = item['state']
-            if item['entity_id'] == 'switch.living_room_nw_corner':
-                self.living_room_lights_nw_corner = item['state']
-            if item['entity_id'] == 'switch.living_room_sw_corner':
-                self.living_room_lights_sw_corner = item['state']
-            if item['entity_id'] == 'switch.air_filter':
-                self.air_filter = item['state']
-            if item['entity_id'] == 'automation.notify_when_laundry_washer_is_done':
-                initial_timestamp = item['attributes']['last_triggered']
-                chicago_time = convert_to_central_time(initial_timestamp)
-                timestamp = chicago_time.isoformat().split('.')[0]
-                self.washer_done_last_fired = timestamp
-            if item['entity_id'] == 'automation.notify_when_laundry_dryer_is_done':
-                initial_timestamp = item['attributes']['last_triggered']
-                chicago_time = convert_to_central_time(initial_timestamp)
-                timestamp = chicago_time.isoformat().split('.')[0]
-                self.dryer_done_last_fired = timestamp
-            if item['entity_id'] == 'calendar.united_states_mo':
-                holiday = item['attributes']['message']
-                holiday_start = item['attributes']['start_time']
-                holiday_start_trim = holiday_start.split(' ')[0]
-                if self.today_date == holiday_start_trim:
-                    holiday_flashy = f"* {holiday} *"
-                    holiday_trim = holiday_flashy[0:MAX_WIDTH]
-                    self.holiday = holiday_trim
-            if item['entity_id'] == 'vacuum.roomba':
-                self.roomba_status = item['state']
-                self.roomba_battery = str(item['attributes']['battery_level']) + '%'
-                self.roomba_bin_full = item['attributes']['bin_full']
+        if self.ha_template:
+            # Let Home Assistant pick out the fields instead of sending every entity
+            url = self.HA_API + 'api/template'
+            req = self.http.post(url, headers=headers, json={'template': STATES_TEMPLATE})
+            req.raise_for_status()
+            return json.loads(req.text)
+
+        # Parse the states one entity at a time as they arrive and keep only
+        # the ones in ENTITIES, rather than loading the whole array
+        url = self.HA_API + 'api/states'
+        with self.http.get(url, headers=headers, stream=True) as req:
+            req.raise_for_status()
+            return list(jsonstream.iter_matching(req.iter_content(STATES_CHUNK_SIZE), 'entity_id', ENTITIES))
+
+    # Dispatch each state object to its ENTITIES handler. Stops as soon as
+    # every registered entity has been seen, then runs the RESOLVERS.
+    def apply_states(self, states):
+        remaining = set(ENTITIES)
+        for item in states:
+            entity = ENTITIES.get(item['entity_id'])
+            if entity is None:
+                continue
+            entity.parse(self, item)
+            remaining.discard(item['entity_id'])
+            if not remaining:
+                break
+        if remaining:
+            log.warning(f'Home Assistant did not report {", ".join(sorted(remaining))}')
+        for resolve in RESOLVERS:
+            resolve(self)
 
     def refresh_router_updates(self, KEY, SECRET):
         self.router_status = 'HEALTHY'
         self.router_updates = 0
-        url = 'https://router.mccormicom.com/api/core/firmware/upgradestatus'
+        url = self.ROUTER_API + 'api/core/firmware/upgradestatus'
+
+        # A cached copy standing in for a router that did not answer
+        def router_down(error):
+            self.router_status = 'DOWN'
+
         try:
-            req = requests.post(url, auth=(KEY, SECRET), verify=False)
-            jd = json.loads(req.text)
-            for line in jd['log'].split('\n'):
-                if 'package(s) will be affected' in line:
-                    self.router_updates = line.split(' ')[2]
-        except ConnectionError:
+            content = self.cache.get('router:upgradestatus',
+                                     lambda headers: self.http.post(url, headers=headers, auth=(KEY, SECRET), verify=False),
+                                     *CACHE_TTLS['router'], on_error=router_down)
+            jd = json.loads(content)
+            matches = ROUTER_UPDATES_PATTERN.findall(jd['log'])
+            if matches:
+                self.router_updates = matches[-1]
+        except requests.ConnectionError:
             self.router_status = 'DOWN'
             return
 
-        # Kick off a firmware upgrade check. It will take a minute but we'll parse the results next execution.
-        url = 'https://router.mccormicom.com/api/core/firmware/check'
-        req = requests.post(url, auth=(KEY, SECRET), verify=False)
+        if self.router_status != 'DOWN':
+            self.schedule_router_check(KEY, SECRET)
+
+    # Kick off a firmware upgrade check on a thread of its own, at most once
+    # every router_check_interval seconds. It takes the router a minute or
+    # so, upgradestatus shows what it found on a later cycle.
+    def schedule_router_check(self, KEY, SECRET):
+        if not self.router_check_lock.acquire(blocking=False):
+            return
+        if time.time() - self.router_check['last_run'] < self.router_check_interval:
+            self.router_check_lock.release()
+            return
+        threading.Thread(target=self.run_router_check, args=(KEY, SECRET), name='router-check').start()
+
+    # Runs holding router_check_lock. The attempt is recorded before the
+    # request, so a router that fails the check is not asked again until
+    # the interval is up either.
+    def run_router_check(self, KEY, SECRET):
+        try:
+            self.router_check['last_run'] = time.time()
+            write_stamp(self.router_check_stamp, self.router_check['last_run'])
+            url = self.ROUTER_API + 'api/core/firmware/check'
+            req = self.http.post(url, auth=(KEY, SECRET), verify=False)
+            req.raise_for_status()
+            self.router_check['result'] = json.loads(req.text)
+            log.info(f"Router firmware check started: {self.router_check['result']}")
+        except (requests.RequestException, OSError, ValueError) as e:
+            log.warning(f'Router firmware check failed: {e!r}')
+        finally:
+            self.router_check_lock.release()
 
-    def refresh_plex(self, PLEX_TOKEN, HA_TOKEN):
+    def refresh_plex(self, PLEX_TOKEN):
         self.plex_status = 'HEALTHY'
         self.plex_streams = []
         self.plex_new_movies = []
@@ -315,86 +699,69 @@ class EPC:
         self.refresh_plex_streams(PLEX_TOKEN)
         if self.plex_status == 'DOWN':
             log.warning('Plex is DOWN!')
-            self.say_plex_is_down(HA_TOKEN)
         else:
             self.refresh_plex_recently_added(PLEX_TOKEN)
 
     def refresh_plex_recently_added(self, PLEX_TOKEN):
         if len(self.plex_streams) > 4:
             return
-        headers = {'X-Plex-Token': PLEX_TOKEN}
-        try:
-            plex_recently_added_xml = requests.get(self.PLEX_API + 'library/sections/2/newest', headers=headers)
-        except ConnectionError:
-            self.plex_status = 'DOWN'
-            return
-        tv_xml = ElementTree.fromstring(plex_recently_added_xml.text)
-
-        tvshows = []
-        for item in tv_xml:
-            new_episode = {}
-            new_episode['season_name'] = item.attrib['parentTitle'].replace('Season ', 'S')
-            new_episode['episode_number'] = item.attrib['index']
-            if 'updatedAt' in item.attrib.keys():
-                new_episode['epoch_updated'] = item.attrib['updatedAt']
-            new_episode['epoch_added'] = item.attrib['addedAt']
-            new_episode['show_name'] = item.attrib['grandparentTitle']
-            tvshows.append(new_episode)
-
-        try:
-            plex_recently_added_xml = requests.get(self.PLEX_API + 'library/sections/1/newest', headers=headers)
-        except ConnectionError:
-            self.plex_status = 'DOWN'
-            return
-        movie_xml = ElementTree.fromstring(plex_recently_added_xml.text)
-
-        movies = []
-        for item in movie_xml:
-            new_movie = {}
-            new_movie['title'] = item.attrib['title']
-            new_movie['year'] = item.attrib['year']
-            new_movie['epoch_added'] = item.attrib['addedAt']
-            movies.append(new_movie)
-
-        movies = sorted(movies, key=lambda d: d['epoch_added'], reverse=True)
-        tvshows = sorted(tvshows, key=lambda d: d['epoch_added'], reverse=True)
+        # Both sections at once, each asking Plex for just the newest few
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+            tv_future = pool.submit(self.fetch_plex_newest, PLEX_TOKEN, 2, parse_plex_episode)
+            movie_future = pool.submit(self.fetch_plex_newest, PLEX_TOKEN, 1, parse_plex_movie)
+            try:
+                tvshows = tv_future.result()
+                movies = movie_future.result()
+            except requests.ConnectionError:
+                self.plex_status = 'DOWN'
+                return
 
         if len(movies) == 0:
             self.plex_new_movies = []
-        elif len(movies) == 1:
-            new_movie = movies[0]['year'] + ' ' + movies[0]['title']
-            self.plex_new_movies = new_movie[0:MAX_WIDTH]
-        elif len(movies) == 2:
-            new_movie = movies[0]['year'] + ' ' + movies[0]['title']
-            new_movie2 = movies[1]['year'] + ' ' + movies[1]['title']
-            self.plex_new_movies = new_movie[0:MAX_WIDTH] + '\n' + new_movie2[0:MAX_WIDTH]
         else:
-            new_movie = movies[0]['year'] + ' ' + movies[0]['title']
-            new_movie2 = movies[1]['year'] + ' ' + movies[1]['title']
-            new_movie3 = movies[2]['year'] + ' ' + movies[2]['title']
-            self.plex_new_movies = new_movie[0:MAX_WIDTH] + '\n' + new_movie2[0:MAX_WIDTH] + '\n' + new_movie3[0:MAX_WIDTH]
+            self.plex_new_movies = '\n'.join(movie['year'] + ' ' + movie['title'] for movie in movies)
         if len(tvshows) == 0:
             self.plex_new_episodes = []
-        elif len(tvshows) == 1:
-            new_episode =  tvshows[0]['show_name'] + ' ' + tvshows[0]['season_name'] + 'E' + tvshows[0]['episode_number']
-            self.plex_new_episodes = new_episode[0:MAX_WIDTH]
-        elif len(tvshows) == 2:
-            new_episode =  tvshows[0]['show_name'] + ' ' + tvshows[0]['season_name'] + 'E' + tvshows[0]['episode_number']
-            new_episode2 = tvshows[1]['show_name'] + ' ' + tvshows[1]['season_name'] + 'E' + tvshows[1]['episode_number']
-            self.plex_new_episodes = new_episode[0:MAX_WIDTH] + '\n' + new_episode2[0:MAX_WIDTH]
         else:
-            new_episode =  tvshows[0]['show_name'] + ' ' + tvshows[0]['season_name'] + 'E' + tvshows[0]['episode_number']
-            new_episode2 = tvshows[1]['show_name'] + ' ' + tvshows[1]['season_name'] + 'E' + tvshows[1]['episode_number']
-            new_episode3 = tvshows[2]['show_name'] + ' ' + tvshows[2]['season_name'] + 'E' + tvshows[2]['episode_number']
-            self.plex_new_episodes = new_episode[0:MAX_WIDTH] + '\n' + new_episode2[0:MAX_WIDTH] + '\n' + new_episode3[0:MAX_WIDTH]
+            self.plex_new_episodes = '\n'.join(
+                episode['show_name'] + ' ' + episode['season_name'] + 'E' + episode['episode_number']
+                for episode in tvshows)
+
+    # The PLEX_RECENT_COUNT newest items of a library section, newest first,
+    # each turned into a dict by parse. The response is parsed as it streams
+    # in, every item is dropped once read, and only the newest few are cached.
+    def fetch_plex_newest(self, PLEX_TOKEN, section, parse):
+        headers = {
+            'X-Plex-Token': PLEX_TOKEN,
+            'X-Plex-Container-Start': '0',
+            'X-Plex-Container-Size': str(PLEX_RECENT_COUNT),
+        }
+        url = self.PLEX_API + f'library/sections/{section}/newest'
+
+        def newest(req):
+            req.raw.decode_content = True
+            items = iter_plex_items(req.raw, parse)
+            # Plex may ignore the container size, so only ever keep the newest few
+            items = heapq.nlargest(PLEX_RECENT_COUNT, items, key=lambda item: int(item['epoch_added']))
+            return json.dumps(items).encode()
+
+        content = self.cache.get(f'plex:newest:{section}:{PLEX_RECENT_COUNT}',
+                                 lambda conditional: self.http.get(url, headers={**headers, **conditional}, stream=True),
+                                 *CACHE_TTLS['plex_library'], parse=newest)
+        return json.loads(content)
 
     def refresh_plex_streams(self, PLEX_TOKEN):
-        headers = {'X-Plex-Token': PLEX_TOKEN}
+        if self.plex_sessions is not None and self.plex_sessions.synced.is_set():
+            self.plex_streams = self.plex_sessions.snapshot()
+            return
         try:
-            plex_sessions_xml = requests.get(self.PLEX_API + 'status/sessions', headers=headers)
-        except ConnectionError:
+            self.plex_streams = self.fetch_plex_streams(PLEX_TOKEN)
+        except requests.ConnectionError:
             self.plex_status = 'DOWN'
-            return
+
+    def fetch_plex_streams(self, PLEX_TOKEN):
+        headers = {'X-Plex-Token': PLEX_TOKEN}
+        plex_sessions_xml = self.http.get(self.PLEX_API + 'status/sessions', headers=headers)
         xml_tree = ElementTree.fromstring(plex_sessions_xml.text)
         streams = []
         for stream in xml_tree:
@@ -431,17 +798,17 @@ class EPC:
         for stream in streams:
             if stream['type'] == 'track':
                 s = f"{stream['user']} \u266c {stream['artist']}."
-                clean_streams.append(s[0:MAX_WIDTH])
+                clean_streams.append(s)
             elif stream['type'] == 'movie':
                 s = f"{stream['user']} \u2680 {stream['title']}."
-                clean_streams.append(s[0:MAX_WIDTH])
+                clean_streams.append(s)
             elif stream['type'] == 'episode':
                 season = stream['season'].replace('Season ', 'S')
                 s = f"{stream['user']} \u30ed {stream['tv_show']} {season}."
-                clean_streams.append(s[0:MAX_WIDTH])
-        self.plex_streams = clean_streams
+                clean_streams.append(s)
+        return clean_streams
 
-    def refresh_worldweather(self, WEATHER_TOKEN):
+    def refresh_dates(self):
         self.timestamp = datetime.now().isoformat().split('.')[0]
         self.today_date = self.timestamp.split('T')[0]
         tomorrow_timestamp = datetime.now() + timedelta(days=1)
@@ -454,13 +821,27 @@ class EPC:
         self.plus_3_timestamp = plus_3_timestamp.isoformat().split('.')[0]
         self.plus_3_date = self.plus_3_timestamp.split('T')[0]
 
+    def refresh_worldweather(self, WEATHER_TOKEN):
+        self.weather_status = 'HEALTHY'
         zipcode = 63021
         url = f'https://api.worldweatheronline.com/premium/v1/weather.ashx?key={WEATHER_TOKEN}&q={zipcode}'
-        resp = requests.request('GET', url)
-        if resp.status_code == 429:
-            log.error('WorldWeather API calls used up for the day.')
-            return
-        xml_data = ElementTree.fromstring(resp.text)
+
+        # A cached forecast standing in for an API that did not answer
+        def weather_down(error):
+            self.weather_status = 'DOWN'
+
+        # The forecast changes a few times a day and calls are metered, so
+        # this only reaches the API when the cached copy runs out
+        try:
+            content = self.cache.get(f'worldweather:{zipcode}', lambda headers: self.http.get(url, headers=headers),
+                                     *CACHE_TTLS['worldweather'], on_error=weather_down)
+        except requests.HTTPError as e:
+            if e.response.status_code == 429:
+                log.error('WorldWeather API calls used up for the day.')
+                self.weather_status = 'DOWN'
+                return
+            raise
+        xml_data = ElementTree.fromstring(content)
 
         for branch in xml_data:
             if branch.tag == 'weather':
@@ -503,111 +884,145 @@ class EPC:
                 self.plus_3_sunhours = branch.text
 
     def draw(self):
-        font16 = ImageFont.truetype('Font.ttc', 16)
-        font18 = ImageFont.truetype('Font.ttc', 18)
-        font24 = ImageFont.truetype('Font.ttc', 24)
-        font40 = ImageFont.truetype('Font.ttc', 40)
+        font18 = fonts.get_font(FONT_PATH, FONT_SIZE)
         self.timestamp = datetime.now().isoformat().split('.')[0]
 
-        # Drawing on the Horizontal image
-        Himage = Image.new('RGB', (self.epd.width, self.epd.height), 0xffffff)  # 255: clear the frame
+        # Only the tiles whose fields changed since the last draw are redrawn
+        frame, dirty = self.layout.render(self, font18)
+
+        # The refresh clock changes every run, so leave it out of the key the
+        # frame cache compares. An unchanged dashboard keeps its old clock.
+        key = frame.tobytes()
+        Himage = frame.copy()
         draw = ImageDraw.Draw(Himage)
-        # Draw the container boxes
-        draw.rounded_rectangle((0, 0, 200, 220),     outline = self.epd.ORANGE, width=2)
-        draw.rounded_rectangle((200, 0, 400, 220),   outline = self.epd.GREEN,  width=2)
-        draw.rounded_rectangle((400, 0, 599, 220),   outline = self.epd.BLUE,   width=2)
-        draw.rounded_rectangle((0, 220, 200, 447),   outline = self.epd.BLUE,   width=2)
-        draw.rounded_rectangle((200, 220, 400, 447), outline = self.epd.RED,    width=2)
-        draw.rounded_rectangle((400, 220, 599, 447), outline = self.epd.YELLOW, width=2)
-        # Draw the top-left box for weather stuff.
-        draw.text((2, 0), f'\u21ba {self.timestamp}',           font=font18, fill=0)
-        draw.text((2, 20), f'Sunrise: {self.next_dawn}',        font=font18, fill=0)
-        draw.text((2, 40), f'Sunset: {self.next_dusk}',         font=font18, fill=0)
-        draw.text((2, 60), f'Weather: {self.weather}',          font=font18, fill=0)
-        draw.text((2, 80), f'Temp: {self.weather_temperature}', font=font18, fill=0)
-        draw.text((105, 80), f'Hum: {self.weather_humidity}',   font=font18, fill=0)
-        draw.text((2, 100), f'TD', font=font18, fill=0)
-        draw.text((28, 100), f'{self.today_high_temp}/{self.today_low_temp}\u00b0F', font=font18, fill=self.epd.GREEN)
-        draw.text((105, 100), f'TM {self.tomorrow_high_temp}/{self.tomorrow_low_temp}\u00b0F', font=font18, fill=0)
-        draw.text((2, 120), f'+2 {self.plus_2_high_temp}/{self.plus_2_low_temp}\u00b0F    +3 {self.plus_3_high_temp}/{self.plus_3_low_temp}\u00b0F', font=font18, fill=0)
-        draw.text((2, 140), f'UV Index: {self.weather_uv_index}', font=font18, fill=0)
-        draw.text((2, 160), f'Pressure: {self.weather_pressure}', font=font18, fill=0)
-        draw.text((2, 180), f'Wind: {self.weather_wind}',         font=font18, fill=0)
-        # Draw the top middle box for printer and router stuff.
-        draw.text((204, 0), f'Printer Black: {self.printer_black_toner}',      font=font18, fill=0)
-        draw.text((204, 20), f'Printer Cyan: {self.printer_cyan_toner}',       font=font18, fill=0)
-        draw.text((204, 40), f'Printer Magenta: {self.printer_magenta_toner}', font=font18, fill=0)
-        draw.text((204, 60), f'Printer Yellow: {self.printer_yellow_toner}',   font=font18, fill=0)
-        if self.router_status == 'HEALTHY':
-            draw.text((204, 100), f'Router Updates: {self.router_updates}',     font=font18, fill=0)
-        draw.text((204, 140), f'Roomba is {self.roomba_status}',               font=font18, fill=0)
-        draw.text((204, 160), f'BAT {self.roomba_battery} FULL {self.roomba_bin_full}', font=font18, fill=0)
-        if self.holiday:
-            draw.text((204, 200), f'{self.holiday}',                           font=font18, fill=0)
-        # Draw the top right box for downloader stuff.
-        draw.text((406, 0), f'SAB Status: {self.sab_status}',            font=font18, fill=0)
-        draw.text((406, 20), f'SAB Queue: {self.sab_queue}',             font=font18, fill=0)
-        draw.text((406, 40), f'SAB Speed: {self.sab_speed}',             font=font18, fill=0)
-        draw.text((406, 60), f'SAB Speedlimit: {self.sab_speedlimit}',   font=font18, fill=0)
-        draw.text((406, 100), 'Deluge',                                  font=font18, fill=0)
-        draw.text((406, 120), f'{self.deluge_status}',                   font=font18, fill=0)
-        draw.text((406, 140), f'Download: {self.deluge_download_speed}', font=font18, fill=0)
-        draw.text((406, 160), f'Upload: {self.deluge_upload_speed}',     font=font18, fill=0)
-        draw.text((406, 180), f'Free Disk: {self.nas_free_disk}',        font=font18, fill=0)
-        # Draw the bottom left box for laundry stuff.
-        draw.text((2, 222), f'Washer: {self.washer_switch}',         font = font18, fill = 0)
-        draw.text((2, 242), f'Usage: {self.washer_1min}/minute',     font = font18, fill = 0)
-        draw.text((2, 262), f'Usage: {self.washer_1mon}/month',      font = font18, fill = 0)
-        draw.text((2, 282), f'Cost: {self.washer_cost_1mon}/month',  font = font18, fill = 0)
-        draw.text((2, 302), f'\u2713 {self.washer_done_last_fired}', font = font18, fill = 0)
-        draw.text((2, 342), f'Dryer: {self.dryer_switch}',           font = font18, fill = 0)
-        draw.text((2, 362), f'Usage: {self.dryer_1min}/minute',      font = font18, fill = 0)
-        draw.text((2, 382), f'Usage: {self.dryer_1mon}/month',       font = font18, fill = 0)
-        draw.text((2, 402), f'Cost: {self.dryer_cost_1mon}/month',   font = font18, fill = 0)
-        draw.text((2, 422), f'\u2713 {self.dryer_done_last_fired}',  font = font18, fill = 0)
-        # Draw the bottom middle box for Plex stuff.
-        draw.text((204, 222), f'Plex', font=font18, fill=0)
-        if self.plex_status == 'HEALTHY':
-            index = 222
-            for stream in self.plex_streams:
+        clock = f'\u21ba {self.timestamp}'
+        draw.text((2, 0), clock, font=font18, fill=0)
+        # Where the last clock was has to be converted again as well
+        clock_box = draw.textbbox((2, 0), clock, font=font18)
+        dirty.append(clock_box)
+        if self.clock_box is not None:
+            dirty.append(self.clock_box)
+        self.clock_box = clock_box
+        log.debug(f'Dirty regions: {dirty}')
+
+        # The refresh runs on the display worker, the returned future is done
+        # once the panel has been updated (or skipped, or superseded).
+        buf = self.epd.getbuffer(Himage, mode='nearest', regions=dirty)
+        return self.worker.submit(buf, callback=self.refresh_done, force=self.force_refresh, key=key)
+
+    # Mark a tile that shows data from a DOWN source, on a free line at y
+    def render_stale(self, t, y, *statuses):
+        if 'DOWN' in statuses:
+            t.text_right(y, 'STALE', fill=self.epd.RED)
+
+    # Top-left box for weather stuff
+    def render_weather(self, t, s):
+        t.text((2, 20), f'Sunrise: {s.next_dawn}')
+        t.text((2, 40), f'Sunset: {s.next_dusk}')
+        t.text((2, 60), f'Weather: {s.weather}')
+        t.text((2, 80), f'Temp: {s.weather_temperature}')
+        t.text((105, 80), f'Hum: {s.weather_humidity}')
+        t.text((2, 100), f'TD')
+        t.text((28, 100), f'{s.today_high_temp}/{s.today_low_temp}\u00b0F', fill=self.epd.GREEN)
+        t.text((105, 100), f'TM {s.tomorrow_high_temp}/{s.tomorrow_low_temp}\u00b0F')
+        t.text((2, 120), f'+2 {s.plus_2_high_temp}/{s.plus_2_low_temp}\u00b0F    +3 {s.plus_3_high_temp}/{s.plus_3_low_temp}\u00b0F')
+        t.text((2, 140), f'UV Index: {s.weather_uv_index}')
+        t.text((2, 160), f'Pressure: {s.weather_pressure}')
+        t.text((2, 180), f'Wind: {s.weather_wind}')
+        self.render_stale(t, 200, s.weather_status, s.sensors_status)
+
+    # Top middle box for printer and router stuff
+    def render_printer(self, t, s):
+        t.text((4, 0), f'Printer Black: {s.printer_black_toner}')
+        t.text((4, 20), f'Printer Cyan: {s.printer_cyan_toner}')
+        t.text((4, 40), f'Printer Magenta: {s.printer_magenta_toner}')
+        t.text((4, 60), f'Printer Yellow: {s.printer_yellow_toner}')
+        self.render_stale(t, 80, s.sensors_status)
+        if s.router_status == 'HEALTHY':
+            t.text((4, 100), f'Router Updates: {s.router_updates}')
+        t.text((4, 140), f'Roomba is {s.roomba_status}')
+        t.text((4, 160), f'BAT {s.roomba_battery} FULL {s.roomba_bin_full}')
+        if s.holiday:
+            t.text((4, 200), f'{s.holiday}')
+
+    # Top right box for downloader stuff
+    def render_downloaders(self, t, s):
+        t.text((6, 0), f'SAB Status: {s.sab_status}')
+        t.text((6, 20), f'SAB Queue: {s.sab_queue}')
+        t.text((6, 40), f'SAB Speed: {s.sab_speed}')
+        t.text((6, 60), f'SAB Speedlimit: {s.sab_speedlimit}')
+        self.render_stale(t, 80, s.sensors_status)
+        t.text((6, 100), 'Deluge')
+        t.text((6, 120), f'{s.deluge_status}')
+        t.text((6, 140), f'Download: {s.deluge_download_speed}')
+        t.text((6, 160), f'Upload: {s.deluge_upload_speed}')
+        t.text((6, 180), f'Free Disk: {s.nas_free_disk}')
+
+    # Bottom left box for laundry stuff
+    def render_laundry(self, t, s):
+        t.text((2, 2), f'Washer: {s.washer_switch}')
+        t.text((2, 22), f'Usage: {s.washer_1min}/minute')
+        t.text((2, 42), f'Usage: {s.washer_1mon}/month')
+        t.text((2, 62), f'Cost: {s.washer_cost_1mon}/month')
+        t.text((2, 82), f'\u2713 {s.washer_done_last_fired}')
+        self.render_stale(t, 102, s.sensors_status)
+        t.text((2, 122), f'Dryer: {s.dryer_switch}')
+        t.text((2, 142), f'Usage: {s.dryer_1min}/minute')
+        t.text((2, 162), f'Usage: {s.dryer_1mon}/month')
+        t.text((2, 182), f'Cost: {s.dryer_cost_1mon}/month')
+        t.text((2, 202), f'\u2713 {s.dryer_done_last_fired}')
+
+    # Bottom middle box for Plex stuff
+    def render_plex(self, t, s):
+        t.text((4, 2), f'Plex')
+        if s.plex_status == 'HEALTHY':
+            index = 2
+            for stream in s.plex_streams:
                 index += 20
-                draw.text((204, index), f'{stream}', font=font18, fill=0)
-            if len(self.plex_streams) == 0:
-                index = 242
-            elif len(self.plex_streams) == 1:
-                index = 262
-            elif len(self.plex_streams) == 2:
-                index = 282
-            elif len(self.plex_streams) == 3:
-                index = 302
-
-            if self.plex_new_movies:
-                draw.text((204, index), f'New Movies:', font=font18, fill=0)
+                t.text((4, index), f'{stream}')
+            if len(s.plex_streams) == 0:
+                index = 22
+            elif len(s.plex_streams) == 1:
+                index = 42
+            elif len(s.plex_streams) == 2:
+                index = 62
+            elif len(s.plex_streams) == 3:
+                index = 82
+
+            if s.plex_new_movies:
+                t.text((4, index), f'New Movies:')
                 index += 20
-                draw.text((204, index), f'{self.plex_new_movies}', font=font18, fill=0)
-            if self.plex_new_episodes:
+                t.text((4, index), f'{s.plex_new_movies}')
+            if s.plex_new_episodes:
                 index += 60
-                draw.text((204, index), f'New Episodes:', font=font18, fill=0)
+                t.text((4, index), f'New Episodes:')
                 index += 20
-                draw.text((204, index), f'{self.plex_new_episodes}', font=font18, fill=0)
+                t.text((4, index), f'{s.plex_new_episodes}')
+        else:
+            index = 22
+            t.text((4, index), f'Plex is DOWN!', fill=self.epd.RED)
+
+    # Bottom right box for Indoor Climate and Air Quality stuff
+    def render_air(self, t, s):
+        t.text((6, 2), f'Indoor Climate and Air')
+        t.text((6, 22), f'Battery: {s.air_detector_battery}')
+        t.text((6, 42), f'Temperature: {s.air_detector_temperature}')
+        t.text((6, 62), f'Humidity: {s.air_detector_humidity}')
+        t.text((6, 82), f'CO2: {s.air_detector_carbon_dioxide}')
+        t.text((6, 102), f'Formald: {s.air_detector_formaldehyde}')
+        t.text((6, 122), f'VOCS: {s.air_detector_vocs}')
+        t.text((6, 142), f'PM2.5: {s.air_detector_pm2_5}')
+        self.render_stale(t, 182, s.sensors_status)
+
+    def refresh_done(self, future):
+        if future.cancelled():
+            log.info('Frame superseded by a newer one before the screen was free.')
+        elif future.exception() is not None:
+            log.error(f'Screen refresh failed: {future.exception()}')
+        elif not future.result():
+            log.info('Screen already shows this frame, refresh skipped.')
         else:
-            index = 242
-            draw.text((204, index), f'Plex is DOWN!', font=font18, fill=self.epd.RED)
-
-        # Draw the bottom right box for Indoor Climate and Air Quality stuff.
-        draw.text((406, 222), f'Indoor Climate and Air', font = font18, fill = 0)
-        draw.text((406, 242), f'Battery: {self.air_detector_battery}', font = font18, fill = 0)
-        draw.text((406, 262), f'Temperature: {self.air_detector_temperature}', font = font18, fill = 0)
-        draw.text((406, 282), f'Humidity: {self.air_detector_humidity}', font = font18, fill = 0)
-        draw.text((406, 302), f'CO2: {self.air_detector_carbon_dioxide}', font = font18, fill = 0)
-        draw.text((406, 322), f'Formald: {self.air_detector_formaldehyde}', font = font18, fill = 0)
-        draw.text((406, 342), f'VOCS: {self.air_detector_vocs}', font = font18, fill = 0)
-        draw.text((406, 362), f'PM2.5: {self.air_detector_pm2_5}', font = font18, fill = 0)
-
-        self.epd.display(self.epd.getbuffer(Himage))
-
-        log.debug("Put screen driver to sleep...")
-        self.epd.sleep()
+            log.debug(f'Panel busy times: {self.epd.busy_times}')
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Per-source circuit breakers.
+#
+# A breaker starts closed and opens after failure_threshold failures in a
+# row. While open, allow() says no until the backoff runs out, so a source
+# that is known to be down costs nothing. The first call after that is a
+# half-open probe: success closes the breaker, failure opens it again with
+# twice the backoff (capped at max_delay), each with some random jitter so
+# sources do not retry in lockstep.
+#
+# Breakers keeps them by name and can persist them to a small JSON file, so
+# one-shot runs started by cron remember an outage between runs.
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=1, base_delay=60, max_delay=3600, jitter=0.2):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+        self.open_until = 0
+
+    def allow(self):
+        if self.state == OPEN:
+            if time.time() < self.open_until:
+                return False
+            self.state = HALF_OPEN
+            logger.info(f'{self.name}: backoff over, probing')
+        return True
+
+    # Returns True if this success ended an outage
+    def record_success(self):
+        recovered = self.state != CLOSED
+        if recovered:
+            logger.info(f'{self.name}: recovered, closing breaker')
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+        return recovered
+
+    # Returns True if this failure started an outage (closed to open)
+    def record_failure(self):
+        self.failures += 1
+        if self.state == CLOSED and self.failures < self.failure_threshold:
+            return False
+        started = self.state == CLOSED
+        self.opens += 1
+        delay = min(self.base_delay * 2 ** (self.opens - 1), self.max_delay)
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        self.state = OPEN
+        self.open_until = time.time() + delay
+        logger.warning(f'{self.name}: breaker open for {delay:.0f}s after {self.failures} failures')
+        return started
+
+    def to_dict(self):
+        return {'state': self.state, 'failures': self.failures, 'opens': self.opens, 'open_until': self.open_until}
+
+    def load_dict(self, state):
+        self.state = state.get('state', CLOSED)
+        self.failures = state.get('failures', 0)
+        self.opens = state.get('opens', 0)
+        self.open_until = state.get('open_until', 0)
+
+
+class Breakers:
+    # path, if given, is where save() keeps every breaker's state and where
+    # it is read back from. Breakers are created on first use with **kwargs.
+    def __init__(self, path=None, **kwargs):
+        self.path = os.path.expanduser(path) if path else None
+        self.kwargs = kwargs
+        self._breakers = {}
+        self._saved = {}
+        self._lock = threading.Lock()
+        if self.path:
+            try:
+                with open(self.path) as f:
+                    self._saved = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._breakers:
+                breaker = CircuitBreaker(name, **self.kwargs)
+                if name in self._saved:
+                    breaker.load_dict(self._saved[name])
+                self._breakers[name] = breaker
+            return self._breakers[name]
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            state = dict(self._saved)
+            state.update((name, breaker.to_dict()) for name, breaker in self._breakers.items())
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
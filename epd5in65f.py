@@ -29,27 +29,239 @@
 # THE SOFTWARE.
 #
 
+import os
+import math
+import time
 import logging
+import hashlib
 import epdconfig
 
 import PIL
-from PIL import Image
+from PIL import Image, ImageChops
 import io
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Display resolution
 EPD_WIDTH       = 600
 EPD_HEIGHT      = 448
 
 logger = logging.getLogger(__name__)
 
+# Translation table that moves a 4 bit palette index into the high nibble
+_HIGH_NIBBLE = bytes((i & 0x0F) << 4 for i in range(256))
+
+def pack_pixels(pixels):
+    # Pack one palette index per byte into two pixels per byte, the left
+    # pixel in the high nibble, which is the layout the panel expects.
+    if numpy is not None:
+        indexes = numpy.frombuffer(pixels, dtype=numpy.uint8)
+        return ((indexes[0::2] << 4) | indexes[1::2]).tobytes()
+
+    # Without NumPy, do the shift with a translate and the OR on two big
+    # integers so the work still happens in C rather than per pixel.
+    pixels = bytes(pixels)
+    high = pixels[0::2].translate(_HIGH_NIBBLE)
+    low = pixels[1::2]
+    packed = int.from_bytes(high, 'big') | int.from_bytes(low, 'big')
+    return packed.to_bytes(len(high), 'big')
+
+# Panel power states, see EPD.init, EPD.sleep and EPD.shutdown
+POWER_OFF   = 'off'      # module_exit done, 5V off, SPI closed
+POWER_SLEEP = 'sleep'    # controller in deep sleep, SPI and GPIO still held
+POWER_AWAKE = 'awake'    # controller initialized and ready for a frame
+
+# Every pixel white (index 1), shared by all Clear() calls
+WHITE_FRAME = bytes([0x11]) * (EPD_WIDTH * EPD_HEIGHT // 2)
+
+# Register tables, (command, data) pairs sent with EPD.send_transaction
+RESOLUTION = bytes((EPD_WIDTH >> 8, EPD_WIDTH & 0xFF, EPD_HEIGHT >> 8, EPD_HEIGHT & 0xFF))
+
+INIT_SEQUENCE = (
+    (0x00, b'\xEF\x08'),             # Panel setting
+    (0x01, b'\x37\x00\x23\x23'),     # Power setting
+    (0x03, b'\x00'),                 # Power off sequence setting
+    (0x06, b'\xC7\xC7\x1D'),         # Booster soft start
+    (0x30, b'\x3C'),                 # PLL control
+    (0x41, b'\x00'),                 # Temperature sensor enable
+    (0x50, b'\x37'),                 # VCOM and data interval setting
+    (0x60, b'\x22'),                 # TCON setting
+    (0x61, RESOLUTION),              # Resolution setting
+    (0xE3, b'\xAA'),                 # Power saving
+)
+
+# Sent after INIT_SEQUENCE once the panel had 100 ms to settle
+INIT_SETTLE_SEQUENCE = (
+    (0x50, b'\x37'),                 # VCOM and data interval setting
+)
+
+RESOLUTION_SEQUENCE = (
+    (0x61, RESOLUTION),              # Resolution setting
+)
+
+SLEEP_SEQUENCE = (
+    (0x07, b'\xA5'),                 # Deep sleep
+)
+
+# 4x4 Bayer matrix used by the ordered dithering mode
+_BAYER_4X4 = (( 0,  8,  2, 10),
+              (12,  4, 14,  6),
+              ( 3, 11,  1,  9),
+              (15,  7, 13,  5))
+
+class Quantizer:
+    # Maps RGB images onto the 7 panel colors. Build it through
+    # get_quantizer() so each palette is only prepared once per process.
+    #
+    # With NumPy the quantizer precomputes a 3D lookup table holding the
+    # nearest palette index for every (r, g, b) cell, so quantizing a frame
+    # is one shift-and-or and one table lookup per pixel. Without NumPy it
+    # falls back to PIL's quantize against a cached palette image, with the
+    # Bayer offsets of the ordered mode added through ImageChops.
+    def __init__(self, palette, bits=5, spread=64):
+        self.palette = tuple(tuple(color) for color in palette)
+        self.bits = bits
+        self.spread = spread
+
+        # PIL wants a full 256 entry palette, pad it with the first color
+        flat = sum(self.palette, ()) + self.palette[0] * (256 - len(self.palette))
+        self.pal_image = Image.new("P", (1,1))
+        self.pal_image.putpalette(flat)
+
+        self.lut = None
+        if numpy is not None:
+            self.lut = self._build_lut()
+
+    def _build_lut(self):
+        # Centre of every cell of the (2^bits)^3 RGB grid
+        size = 1 << self.bits
+        shift = 8 - self.bits
+        centres = (numpy.arange(size, dtype=numpy.int32) << shift) + (1 << shift >> 1)
+        r, g, b = numpy.meshgrid(centres, centres, centres, indexing='ij')
+        grid = numpy.stack((r, g, b), axis=-1).reshape(-1, 1, 3)
+
+        palette = numpy.array(self.palette, dtype=numpy.int32).reshape(1, -1, 3)
+        distance = ((grid - palette) ** 2).sum(axis=-1)
+        return distance.argmin(axis=-1).astype(numpy.uint8)
+
+    def quantize(self, image, mode='nearest', origin=(0, 0)):
+        # Returns one palette index per byte, row by row.
+        # mode is 'nearest', 'ordered' (Bayer dither) or 'floyd'
+        # (Floyd-Steinberg error diffusion, done by PIL). origin is where
+        # image sits in the frame, so the Bayer pattern of a crop lines up
+        # with the one of the whole frame.
+        if mode not in ('nearest', 'ordered', 'floyd'):
+            raise ValueError("Unknown quantize mode: %s" % mode)
+        image = image.convert("RGB")
+        if mode == 'floyd':
+            return image.quantize(palette=self.pal_image, dither=Image.Dither.FLOYDSTEINBERG).tobytes('raw')
+        if self.lut is None:
+            if mode == 'ordered':
+                image = self._ordered_threshold(image, origin)
+            return image.quantize(palette=self.pal_image, dither=Image.Dither.NONE).tobytes('raw')
+
+        rgb = numpy.asarray(image)
+        if mode == 'ordered':
+            height, width = rgb.shape[:2]
+            bayer = (numpy.array(_BAYER_4X4, dtype=numpy.int16) * 2 + 1 - 16) * self.spread // 32
+            rows = (numpy.arange(height) + origin[1]) % 4
+            columns = (numpy.arange(width) + origin[0]) % 4
+            threshold = bayer[rows[:, None], columns[None, :]]
+            rgb = numpy.clip(rgb + threshold[..., None], 0, 255).astype(numpy.uint8)
+
+        rgb = (rgb >> (8 - self.bits)).astype(numpy.uint16)
+        index = (rgb[..., 0] << (2 * self.bits)) | (rgb[..., 1] << self.bits) | rgb[..., 2]
+        return self.lut[index].tobytes()
+
+    def _ordered_threshold(self, image, origin):
+        # The Bayer offsets of the NumPy path without NumPy: one row of
+        # offsets per pattern row, tiled into an image and added (or, for
+        # the negative ones, subtracted) on every band, clipping at 0 and 255
+        offsets = [[(value * 2 + 1 - 16) * self.spread // 32 for value in row] for row in _BAYER_4X4]
+        width, height = image.size
+        repeat = width // 4 + 2
+        layers = []
+        for sign in (1, -1):
+            rows = []
+            for row in offsets:
+                pattern = bytes(max(sign * offset, 0) for offset in row)
+                start = origin[0] % 4
+                rows.append((pattern * repeat)[start:start + width])
+            data = b''.join(rows[(y + origin[1]) % 4] for y in range(height))
+            layer = Image.frombytes('L', (width, height), data)
+            layers.append(Image.merge('RGB', (layer, layer, layer)))
+        return ImageChops.subtract(ImageChops.add(image, layers[0]), layers[1])
+
+_quantizers = {}
+
+def get_quantizer(palette):
+    # One Quantizer per palette per process, the lookup table is not cheap
+    palette = tuple(tuple(color) for color in palette)
+    if palette not in _quantizers:
+        _quantizers[palette] = Quantizer(palette)
+    return _quantizers[palette]
+
+class BusyTimeoutError(TimeoutError):
+    # The panel held BUSY for longer than EPD.busy_timeout_ms
+    pass
+
+class FrameCache:
+    # Remembers a digest of the last buffer shown on the panel in a small
+    # file, so the next process can tell the panel already shows a frame.
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+
+    def digest(self, buf):
+        return hashlib.sha256(buf).hexdigest()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def matches(self, buf):
+        return self.load() == self.digest(buf)
+
+    def store(self, buf):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.digest(buf))
+        os.replace(tmp_path, self.path)
+
+    def invalidate(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
 class EPD:
-    def __init__(self):
+    def __init__(self, frame_cache=None, busy_timeout_ms=60000, keep_open=False):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
         self.busy_pin = epdconfig.BUSY_PIN
         self.cs_pin = epdconfig.CS_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        self.frame_cache = frame_cache
+        # The last buffer getbuffer() produced, and the (mode, calibrated) it
+        # was made with, kept so later frames only convert what changed
+        self.packed = None
+        self.packed_mode = None
+        # A refresh takes around 30 s, anything much longer is a stuck
+        # panel. None waits forever. busy_times holds how long the last
+        # wait of each phase took, in seconds.
+        self.busy_timeout_ms = busy_timeout_ms
+        self.busy_times = {}
+        # With keep_open, refresh() leaves the panel in deep sleep but keeps
+        # the SPI handle and GPIO open, for long running processes.
+        self.keep_open = keep_open
+        self.power_state = POWER_OFF
         self.BLACK  = 0x000000   #   0000  BGR
         self.WHITE  = 0xffffff   #   0001
         self.GREEN  = 0x00ff00   #   0010
@@ -58,6 +270,14 @@ class EPD:
         self.YELLOW = 0x00ffff   #   0101
         self.ORANGE = 0x0080ff   #   0110
 
+        # The same 7 colors in panel index order as RGB. The calibrated
+        # entries are what the ACeP pigments actually look like, quantizing
+        # against them gives a closer match for photos and gradients.
+        self.PALETTE = ((0, 0, 0), (255, 255, 255), (0, 255, 0), (0, 0, 255),
+                        (255, 0, 0), (255, 255, 0), (255, 128, 0))
+        self.CALIBRATED_PALETTE = ((57, 48, 57), (255, 255, 255), (58, 91, 70), (61, 59, 94),
+                                   (156, 72, 75), (208, 190, 71), (177, 106, 73))
+
 
     # Hardware reset
     def reset(self):
@@ -87,65 +307,78 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
 
-    def ReadBusyHigh(self):
+    # Send a command byte and its data payload as one transaction, with a
+    # single DC toggle and a single SPI write for the whole payload
+    def send_transaction(self, command, data=b''):
+        epdconfig.digital_write(self.dc_pin, 0)
+        epdconfig.digital_write(self.cs_pin, 0)
+        epdconfig.spi_writebyte([command])
+        if len(data):
+            epdconfig.digital_write(self.dc_pin, 1)
+            epdconfig.spi_writebyte2(data)
+        epdconfig.digital_write(self.cs_pin, 1)
+
+    def send_sequence(self, sequence):
+        for command, data in sequence:
+            self.send_transaction(command, data)
+
+    def wait_busy(self, level, phase):
+        if self.busy_timeout_ms is None:
+            timeout = None
+        else:
+            timeout = self.busy_timeout_ms / 1000.0
+
+        start = time.monotonic()
+        released = epdconfig.wait_for_level(self.busy_pin, level, timeout)
+        self.busy_times[phase] = time.monotonic() - start
+        if not released:
+            raise BusyTimeoutError("e-Paper still busy after %.3f s (%s)" % (self.busy_times[phase], phase))
+        logger.debug("e-Paper busy release after %.3f s (%s)" % (self.busy_times[phase], phase))
+
+    def ReadBusyHigh(self, phase='busy'):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 0):      # 0: idle, 1: busy
-            epdconfig.delay_ms(100)
-        logger.debug("e-Paper busy release")
+        self.wait_busy(1, phase)
 
-    def ReadBusyLow(self):
+    def ReadBusyLow(self, phase='busy'):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 1):      # 0: idle, 1: busy
-            epdconfig.delay_ms(100)
-        logger.debug("e-Paper busy release")
+        self.wait_busy(0, phase)
 
+    # Bring the panel to POWER_AWAKE. The module is only opened from
+    # POWER_OFF, and the controller only leaves deep sleep through a hardware
+    # reset, so an already awake panel is left alone.
     def init(self):
-        if (epdconfig.module_init() != 0):
-            return -1
+        if self.power_state == POWER_AWAKE:
+            return 0
+        if self.power_state == POWER_OFF:
+            if (epdconfig.module_init() != 0):
+                return -1
+            self.power_state = POWER_SLEEP
+
         # EPD hardware init start
         self.reset()
 
-        self.ReadBusyHigh()
-        self.send_command(0x00)
-        self.send_data(0xEF)
-        self.send_data(0x08)
-        self.send_command(0x01)
-        self.send_data(0x37)
-        self.send_data(0x00)
-        self.send_data(0x23)
-        self.send_data(0x23)
-        self.send_command(0x03)
-        self.send_data(0x00)
-        self.send_command(0x06)
-        self.send_data(0xC7)
-        self.send_data(0xC7)
-        self.send_data(0x1D)
-        self.send_command(0x30)
-        self.send_data(0x3c)
-        self.send_command(0x41)
-        self.send_data(0x00)
-        self.send_command(0x50)
-        self.send_data(0x37)
-        self.send_command(0x60)
-        self.send_data(0x22)
-        self.send_command(0x61)
-        self.send_data(0x02)
-        self.send_data(0x58)
-        self.send_data(0x01)
-        self.send_data(0xC0)
-        self.send_command(0xE3)
-        self.send_data(0xAA)
+        self.ReadBusyHigh('reset')
+        self.send_sequence(INIT_SEQUENCE)
 
         epdconfig.delay_ms(100)
-        self.send_command(0x50)
-        self.send_data(0x37)
+        self.send_sequence(INIT_SETTLE_SEQUENCE)
         # EPD hardware init end
+        self.power_state = POWER_AWAKE
         return 0
 
-    def getbuffer(self, image):
-        # Create a pallette with the 7 colors supported by the panel
-        pal_image = Image.new("P", (1,1))
-        pal_image.putpalette( (0,0,0,  255,255,255,  0,255,0,   0,0,255,  255,0,0,  255,255,0, 255,128,0) + (0,0,0)*249)
+    # mode selects the quantizer: 'floyd' dithers like PIL always did,
+    # 'nearest' maps each pixel to its closest color through the lookup
+    # table (best for flat UI colors), 'ordered' adds a Bayer dither to it.
+    #
+    # regions, a list of (left, top, right, bottom) boxes, says the image
+    # only differs from the one of the previous call inside them. Then only
+    # those boxes are converted, in place in the kept buffer. Error
+    # diffusion spreads past any box, so 'floyd' always converts it all.
+    def getbuffer(self, image, mode='floyd', calibrated=False, regions=None):
+        if calibrated:
+            quantizer = get_quantizer(self.CALIBRATED_PALETTE)
+        else:
+            quantizer = get_quantizer(self.PALETTE)
 
         # Check if we need to rotate the image
         imwidth, imheight = image.size
@@ -153,65 +386,119 @@ class EPD:
             image_temp = image
         elif(imwidth == self.height and imheight == self.width):
             image_temp = image.rotate(90, expand=True)
+            # The boxes are in the unrotated image
+            regions = None
         else:
             logger.warning("Invalid image dimensions: %d x %d, expected %d x %d" % (imwidth, imheight, self.width, self.height))
 
-        # Convert the soruce image to the 7 colors, dithering if needed
-        image_7color = image_temp.convert("RGB").quantize(palette=pal_image)
-        buf_7color = bytearray(image_7color.tobytes('raw'))
+        if (regions is None or mode == 'floyd' or self.packed is None
+                or self.packed_mode != (mode, calibrated)):
+            # Convert the soruce image to the 7 colors, dithering if needed
+            buf_7color = quantizer.quantize(image_temp, mode)
 
-        # PIL does not support 4 bit color, so pack the 4 bits of color
-        # into a single byte to transfer to the panel
-        buf = [0x00] * int(self.width * self.height / 2)
-        idx = 0
-        for i in range(0, len(buf_7color), 2):
-            buf[idx] = (buf_7color[i] << 4) + buf_7color[i+1]
-            idx += 1
+            # PIL does not support 4 bit color, so pack the 4 bits of color
+            # into a single byte to transfer to the panel
+            self.packed = bytearray(pack_pixels(buf_7color))
+            self.packed_mode = (mode, calibrated)
+        else:
+            for region in regions:
+                self.update_region(image_temp, quantizer, mode, region)
+
+        # A copy, the display worker may still be sending it when the next
+        # frame updates the kept buffer
+        return bytes(self.packed)
 
-        return buf
+    # Quantize and pack one box of image into the kept buffer. The box is
+    # clipped to the panel and widened to whole bytes (pixel pairs).
+    def update_region(self, image, quantizer, mode, region):
+        left, top, right, bottom = region
+        left = max(math.floor(left), 0) & ~1
+        top = max(math.floor(top), 0)
+        right = min(math.ceil(right / 2) * 2, self.width)
+        bottom = min(math.ceil(bottom), self.height)
+        if left >= right or top >= bottom:
+            return
+
+        packed = pack_pixels(quantizer.quantize(image.crop((left, top, right, bottom)), mode, (left, top)))
+        row_bytes = (right - left) // 2
+        if numpy is not None:
+            frame = numpy.frombuffer(self.packed, dtype=numpy.uint8).reshape(self.height, self.width // 2)
+            frame[top:bottom, left // 2:right // 2] = numpy.frombuffer(packed, dtype=numpy.uint8).reshape(-1, row_bytes)
+            return
+        for row in range(bottom - top):
+            start = ((top + row) * self.width + left) // 2
+            self.packed[start:start + row_bytes] = packed[row * row_bytes:(row + 1) * row_bytes]
 
     def display(self,image):
-        self.send_command(0x61) #Set Resolution setting
-        self.send_data(0x02)
-        self.send_data(0x58)
-        self.send_data(0x01)
-        self.send_data(0xC0)
-        self.send_command(0x10)
-
-        self.send_data2(image)
+        # refresh() records the frame once it is shown, anything else
+        # leaves the panel in a state the cache knows nothing about
+        if self.frame_cache is not None:
+            self.frame_cache.invalidate()
+
+        self.send_frame(image)
+
+    # Write a packed frame to the panel RAM and run a refresh cycle
+    def send_frame(self, buf):
+        self.send_sequence(RESOLUTION_SEQUENCE)
+        self.send_transaction(0x10, buf)  # Data start transmission
+
         self.send_command(0x04) #0x04
-        self.ReadBusyHigh()
+        self.ReadBusyHigh('power_on')
         self.send_command(0x12) #0x12
-        self.ReadBusyHigh()
+        self.ReadBusyHigh('refresh')
         self.send_command(0x02) #0x02
-        self.ReadBusyLow()
+        self.ReadBusyLow('power_off')
         epdconfig.delay_ms(500)
 
     def Clear(self):
-        self.send_command(0x61) #Set Resolution setting
-        self.send_data(0x02)
-        self.send_data(0x58)
-        self.send_data(0x01)
-        self.send_data(0xC0)
-        self.send_command(0x10)
+        if self.frame_cache is not None:
+            self.frame_cache.invalidate()
 
         # Set all pixels to white
-        buf = [0x11] * int(self.width * self.height / 2)
-        self.send_data2(buf)
+        self.send_frame(WHITE_FRAME)
 
-        self.send_command(0x04) #0x04
-        self.ReadBusyHigh()
-        self.send_command(0x12) #0x12
-        self.ReadBusyHigh()
-        self.send_command(0x02) #0x02
-        self.ReadBusyLow()
-        epdconfig.delay_ms(500)
+    # Wake the panel, show buf and put it back to sleep, unless the frame
+    # cache says the panel already shows it. key is what gets hashed and
+    # defaults to buf, pass something else to ignore parts of the frame
+    # (like a clock) when deciding. Returns True if the panel refreshed.
+    def refresh(self, buf, force=False, key=None):
+        if key is None:
+            key = buf
+        if not force and self.frame_cache is not None and self.frame_cache.matches(key):
+            logger.info("Frame unchanged, skipping panel refresh")
+            return False
 
-    def sleep(self):
-        epdconfig.delay_ms(500)
-        self.send_command(0x07) # DEEP_SLEEP
-        self.send_data(0XA5)
-        epdconfig.digital_write(self.reset_pin, 0)
+        if self.init() != 0:
+            raise IOError("e-Paper module init failed")
+        self.display(buf)
+        self.sleep(power_off=not self.keep_open)
+        if self.frame_cache is not None:
+            self.frame_cache.store(key)
+        return True
+
+    # Put the controller in deep sleep. With power_off the module is shut
+    # down as well, otherwise the SPI handle and GPIO stay open so the next
+    # init() only needs a reset.
+    def sleep(self, power_off=True):
+        if self.power_state == POWER_AWAKE:
+            epdconfig.delay_ms(500)
+            self.send_sequence(SLEEP_SEQUENCE)
+            epdconfig.digital_write(self.reset_pin, 0)
+            self.power_state = POWER_SLEEP
+
+        if power_off and self.power_state == POWER_SLEEP:
+            epdconfig.delay_ms(2000)
+            epdconfig.module_exit()
+            self.power_state = POWER_OFF
 
-        epdconfig.delay_ms(2000)
-        epdconfig.module_exit()
+    # Leave the panel asleep and powered off and release the GPIO lines,
+    # for when the process exits. module_exit runs at most once: the Jetson
+    # and Sunrise backends free their pins on every call and fail on the
+    # next. After a one-shot refresh the module is already off; gpiozero
+    # closes the Raspberry Pi pins itself at interpreter exit.
+    def shutdown(self):
+        self.sleep(power_off=False)
+        if self.power_state == POWER_SLEEP:
+            epdconfig.delay_ms(2000)
+            epdconfig.module_exit(cleanup=True)
+            self.power_state = POWER_OFF
@@ -31,13 +31,48 @@ import os
 import logging
 import sys
 import time
-import subprocess
+import threading
 
 from ctypes import *
 
 logger = logging.getLogger(__name__)
 
 
+def _poll_for_level(read, pin, level, timeout):
+    # Fallback for backends without edge events. Polls quickly at first so
+    # short waits return promptly, backing off to 100 ms for long refreshes.
+    deadline = None if timeout is None else time.monotonic() + timeout
+    interval = 0.001
+    while read(pin) != level:
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            interval = min(interval, remaining)
+        time.sleep(interval)
+        interval = min(interval * 2, 0.1)
+    return True
+
+
+def spidev_bufsiz():
+    # Largest single transfer the spidev driver accepts
+    try:
+        with open('/sys/module/spidev/parameters/bufsiz') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 4096
+
+
+def _chunks(data, size):
+    # Split any buffer into size byte memoryview slices without copying.
+    # Plain lists of ints are packed into bytes once first.
+    if isinstance(data, (list, tuple)):
+        data = bytes(data)
+    view = memoryview(data).cast('B')
+    for start in range(0, len(view), size):
+        yield view[start:start + size]
+
+
 class RaspberryPi:
     # Pin definition
     RST_PIN  = 17
@@ -58,6 +93,7 @@ class RaspberryPi:
         # self.GPIO_CS_PIN     = gpiozero.LED(self.CS_PIN)
         self.GPIO_PWR_PIN    = gpiozero.LED(self.PWR_PIN)
         self.GPIO_BUSY_PIN   = gpiozero.Button(self.BUSY_PIN, pull_up = False)
+        self.bufsiz = spidev_bufsiz()
 
     def digital_write(self, pin, value):
         if pin == self.RST_PIN:
@@ -93,6 +129,15 @@ class RaspberryPi:
         elif pin == self.PWR_PIN:
             return self.PWR_PIN.value
 
+    def wait_for_level(self, pin, level, timeout=None):
+        # gpiozero watches the BUSY pin for edges, so block on its event
+        # rather than polling. Returns False if timeout seconds pass first.
+        if pin == self.BUSY_PIN:
+            if level:
+                return self.GPIO_BUSY_PIN.wait_for_press(timeout)
+            return self.GPIO_BUSY_PIN.wait_for_release(timeout)
+        return _poll_for_level(self.digital_read, pin, level, timeout)
+
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
@@ -100,7 +145,8 @@ class RaspberryPi:
         self.SPI.writebytes(data)
 
     def spi_writebyte2(self, data):
-        self.SPI.writebytes2(data)
+        for chunk in _chunks(data, self.bufsiz):
+            self.SPI.writebytes2(chunk)
 
     def DEV_SPI_write(self, data):
         self.DEV_SPI.DEV_SPI_SendData(data)
@@ -187,6 +233,14 @@ class JetsonNano:
         if self.SPI is None:
             raise RuntimeError('Cannot find sysfs_software_spi.so')
 
+        # Builds of the library that export
+        #   void SYSFS_software_spi_transfer_buffer(const uint8_t *data, uint32_t len)
+        # take a whole buffer per call, otherwise fall back to one call per byte
+        self._transfer_buffer = getattr(self.SPI, 'SYSFS_software_spi_transfer_buffer', None)
+        if self._transfer_buffer is not None:
+            self._transfer_buffer.argtypes = [ctypes.c_void_p, ctypes.c_uint32]
+            self._transfer_buffer.restype = None
+
         import Jetson.GPIO
         self.GPIO = Jetson.GPIO
 
@@ -196,6 +250,9 @@ class JetsonNano:
     def digital_read(self, pin):
         return self.GPIO.input(self.BUSY_PIN)
 
+    def wait_for_level(self, pin, level, timeout=None):
+        return _poll_for_level(self.digital_read, pin, level, timeout)
+
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
@@ -203,8 +260,18 @@ class JetsonNano:
         self.SPI.SYSFS_software_spi_transfer(data[0])
 
     def spi_writebyte2(self, data):
-        for i in range(len(data)):
-            self.SPI.SYSFS_software_spi_transfer(data[i])
+        if self._transfer_buffer is None:
+            for i in range(len(data)):
+                self.SPI.SYSFS_software_spi_transfer(data[i])
+            return
+
+        # Hand the buffer itself to C: writable buffers are wrapped in place,
+        # bytes are passed as is, anything else is packed into bytes once.
+        try:
+            buf = (c_ubyte * len(data)).from_buffer(data)
+        except TypeError:
+            buf = bytes(data)
+        self._transfer_buffer(buf, len(data))
 
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
@@ -220,7 +287,7 @@ class JetsonNano:
         self.SPI.SYSFS_software_spi_begin()
         return 0
 
-    def module_exit(self):
+    def module_exit(self, cleanup=False):
         logger.debug("spi end")
         self.SPI.SYSFS_software_spi_end()
 
@@ -247,6 +314,7 @@ class SunriseX3:
 
         self.GPIO = Hobot.GPIO
         self.SPI = spidev.SpiDev()
+        self.bufsiz = spidev_bufsiz()
 
     def digital_write(self, pin, value):
         self.GPIO.output(pin, value)
@@ -254,6 +322,9 @@ class SunriseX3:
     def digital_read(self, pin):
         return self.GPIO.input(pin)
 
+    def wait_for_level(self, pin, level, timeout=None):
+        return _poll_for_level(self.digital_read, pin, level, timeout)
+
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
@@ -261,9 +332,10 @@ class SunriseX3:
         self.SPI.writebytes(data)
 
     def spi_writebyte2(self, data):
-        # for i in range(len(data)):
-        #     self.SPI.writebytes([data[i]])
-        self.SPI.xfer3(data)
+        # writebytes2 takes the buffer as is, xfer3 copied it into a list
+        # and read the same amount back for nothing
+        for chunk in _chunks(data, self.bufsiz):
+            self.SPI.writebytes2(chunk)
 
     def module_init(self):
         if self.Flag == 0:
@@ -286,7 +358,7 @@ class SunriseX3:
         else:
             return 0
 
-    def module_exit(self):
+    def module_exit(self, cleanup=False):
         logger.debug("spi end")
         self.SPI.close()
 
@@ -299,22 +371,251 @@ class SunriseX3:
         self.GPIO.cleanup([self.RST_PIN, self.DC_PIN, self.CS_PIN, self.BUSY_PIN], self.PWR_PIN)
 
 
-if sys.version_info[0] == 2:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE)
-else:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE, text=True)
-output, _ = process.communicate()
-if sys.version_info[0] == 2:
-    output = output.decode(sys.stdout.encoding)
+class Virtual:
+    # Stand-in panel for machines without the hardware, selected with
+    # EPD_BACKEND=virtual. It captures the command/data stream, decodes each
+    # refreshed frame into a PNG and models how long BUSY is held.
+    #
+    # EPD_VIRTUAL_OUTPUT   PNG written on every refresh (unset: keep in memory)
+    # EPD_VIRTUAL_SCALE    multiplier on every modelled delay, 0 runs flat out
+
+    # Pin definition
+    RST_PIN  = 17
+    DC_PIN   = 25
+    CS_PIN   = 8
+    BUSY_PIN = 24
+    PWR_PIN  = 18
+
+    # Modelled timings, in ms unless noted. BUSY is held after a reset and
+    # after the power on (0x04), refresh (0x12) and power off (0x02) commands.
+    TIMING = {
+        'reset':     20,
+        'power_on':  120,
+        'refresh':   12000,
+        'power_off': 120,
+        'call_us':   0,           # fixed cost of every GPIO or SPI call
+        'spi_hz':    4000000,     # SPI clock, as set up by the real backends
+    }
+
+    # Colors of the 7 panel indexes, used to decode frames
+    PALETTE = (0, 0, 0,  255, 255, 255,  0, 255, 0,  0, 0, 255,  255, 0, 0,  255, 255, 0,  255, 128, 0)
+
+    def __init__(self, output=None, timing=None, time_scale=None):
+        self.output = output or os.getenv('EPD_VIRTUAL_OUTPUT')
+        self.timing = dict(self.TIMING, **(timing or {}))
+        if time_scale is None:
+            time_scale = float(os.getenv('EPD_VIRTUAL_SCALE', '1'))
+        self.time_scale = time_scale
+
+        self.bufsiz = 4096
+        self.pins = {self.RST_PIN: 0, self.DC_PIN: 0, self.CS_PIN: 1, self.PWR_PIN: 0}
+        # BUSY reads busy_level until busy_until, then idle_level
+        self.busy_level = 0
+        self.busy_until = 0.0
+        self.idle_level = 0
+
+        # Captured (command, data) transactions since module_init or the
+        # last refresh, the latest resolution and frame payloads, and stats
+        self.transactions = []
+        self._data = None
+        self._payloads = {}
+        self.frame = None
+        self.frames = 0
+        self.spi_calls = 0
+        self.spi_bytes = 0
+        self.gpio_calls = 0
+        self.busy_time = 0.0
+
+    def _spend(self, seconds):
+        seconds *= self.time_scale
+        if seconds <= 0:
+            return
+        if seconds < 0.001:
+            # time.sleep overshoots badly at this scale, spin instead
+            end = time.perf_counter() + seconds
+            while time.perf_counter() < end:
+                pass
+        else:
+            time.sleep(seconds)
+
+    def _hold_busy(self, name, busy_level, idle_level):
+        duration = self.timing[name] / 1000.0 * self.time_scale
+        self.busy_level = busy_level
+        self.idle_level = idle_level
+        self.busy_until = time.monotonic() + duration
+        self.busy_time += duration
 
-if "Raspberry" in output:
-    implementation = RaspberryPi()
-elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
-    implementation = SunriseX3()
-else:
-    implementation = JetsonNano()
+    def digital_write(self, pin, value):
+        self.gpio_calls += 1
+        self._spend(self.timing['call_us'] / 1000000.0)
+        if pin == self.RST_PIN and value and not self.pins[pin]:
+            # Rising edge at the end of a reset pulse
+            self._hold_busy('reset', 0, 1)
+        self.pins[pin] = 1 if value else 0
 
-for func in [x for x in dir(implementation) if not x.startswith('_')]:
-    setattr(sys.modules[__name__], func, getattr(implementation, func))
+    def digital_read(self, pin):
+        if pin == self.BUSY_PIN:
+            if time.monotonic() < self.busy_until:
+                return self.busy_level
+            return self.idle_level
+        return self.pins.get(pin, 0)
+
+    def wait_for_level(self, pin, level, timeout=None):
+        # Nothing to poll, the model knows when BUSY will change
+        if self.digital_read(pin) == level:
+            return True
+        if pin != self.BUSY_PIN or self.idle_level != level:
+            if timeout is not None:
+                time.sleep(timeout)
+            return False
+        remaining = self.busy_until - time.monotonic()
+        if timeout is not None and remaining > timeout:
+            time.sleep(timeout)
+            return False
+        time.sleep(max(remaining, 0))
+        return True
+
+    def delay_ms(self, delaytime):
+        self._spend(delaytime / 1000.0)
+
+    def _transfer(self, data):
+        self.spi_calls += 1
+        self.spi_bytes += len(data)
+        self._spend(self.timing['call_us'] / 1000000.0 + len(data) * 8.0 / self.timing['spi_hz'])
+
+        if self.pins[self.DC_PIN] == 0:
+            for command in data:
+                self._data = bytearray()
+                self.transactions.append((command, self._data))
+                if command in (0x61, 0x10):
+                    self._payloads[command] = self._data
+                self._command(command)
+        elif self._data is not None:
+            self._data.extend(data)
+
+    def _command(self, command):
+        if command == 0x04:
+            self._hold_busy('power_on', 0, 1)
+        elif command == 0x12:
+            self._hold_busy('refresh', 0, 1)
+            self._show_frame()
+            # Only the payloads are needed from here on, so a panel kept
+            # open across refreshes does not pile up every frame sent
+            self.transactions = []
+        elif command == 0x02:
+            self._hold_busy('power_off', 1, 0)
+
+    def _show_frame(self):
+        resolution = self._payloads.get(0x61)
+        frame = self._payloads.get(0x10)
+        if resolution is None or len(resolution) != 4 or frame is None:
+            logger.warning("Virtual panel refreshed without a resolution and frame")
+            return
+        self.frames += 1
+        self.frame = (resolution[0] << 8 | resolution[1], resolution[2] << 8 | resolution[3], bytes(frame))
+        if self.output:
+            self.render().save(self.output)
+            logger.debug("Virtual panel frame %d written to %s" % (self.frames, self.output))
+
+    # Decode the last refreshed frame into an RGB image of what the panel shows
+    def render(self):
+        from PIL import Image
+
+        width, height, frame = self.frame
+        pixels = bytearray(len(frame) * 2)
+        pixels[0::2] = frame.translate(bytes(i >> 4 for i in range(256)))
+        pixels[1::2] = frame.translate(bytes(i & 0x0F for i in range(256)))
+        image = Image.frombytes('P', (width, height), bytes(pixels[:width * height]))
+        image.putpalette(self.PALETTE)
+        return image.convert('RGB')
+
+    def spi_writebyte(self, data):
+        self._transfer(data)
+
+    def spi_writebyte2(self, data):
+        # Same chunking as the spidev backends, so call counts match
+        for chunk in _chunks(data, self.bufsiz):
+            self._transfer(chunk)
+
+    def module_init(self, cleanup=False):
+        self.transactions = []
+        self._data = None
+        self._payloads = {}
+        self.pins[self.PWR_PIN] = 1
+        return 0
+
+    def module_exit(self, cleanup=False):
+        logger.debug("close 5V, Module enters 0 power consumption ...")
+        self.pins[self.RST_PIN] = 0
+        self.pins[self.DC_PIN] = 0
+        self.pins[self.PWR_PIN] = 0
+
+
+BACKENDS = {
+    'raspberrypi': RaspberryPi,
+    'jetsonnano':  JetsonNano,
+    'sunrisex3':   SunriseX3,
+    'virtual':     Virtual,
+}
+
+_backend_class = None
+_implementation = None
+_lock = threading.Lock()
+
+
+def detect_backend():
+    # Pick the backend class for this machine without constructing it.
+    # EPD_BACKEND (one of BACKENDS) skips the detection.
+    name = os.getenv('EPD_BACKEND', '').lower()
+    if name:
+        if name not in BACKENDS:
+            raise RuntimeError('Unknown EPD_BACKEND %s, expected one of %s' % (name, ', '.join(BACKENDS)))
+        return BACKENDS[name]
+
+    try:
+        with open('/proc/cpuinfo') as f:
+            if 'Raspberry' in f.read():
+                return RaspberryPi
+    except OSError:
+        pass
+    if os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
+        return SunriseX3
+    return JetsonNano
+
+
+def get_implementation():
+    # Construct the backend on first use and publish its methods as module
+    # functions, so later lookups like epdconfig.digital_write are direct.
+    global _backend_class, _implementation
+    with _lock:
+        if _implementation is None:
+            if _backend_class is None:
+                _backend_class = detect_backend()
+            implementation = _backend_class()
+            module = sys.modules[__name__]
+            for func in [x for x in dir(implementation) if not x.startswith('_')]:
+                setattr(module, func, getattr(implementation, func))
+            module.implementation = implementation
+            _implementation = implementation
+    return _implementation
+
+
+def __getattr__(name):
+    # Only reached for names not published yet. Pin numbers are read off the
+    # backend class, so creating an EPD does not touch the hardware.
+    global _backend_class
+    if name.startswith('__'):
+        raise AttributeError(name)
+    if name.endswith('_PIN'):
+        if _backend_class is None:
+            _backend_class = detect_backend()
+        if hasattr(_backend_class, name):
+            return getattr(_backend_class, name)
+    if name == 'implementation':
+        return get_implementation()
+    try:
+        return getattr(get_implementation(), name)
+    except AttributeError:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 ### END OF FILE ###
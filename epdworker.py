@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Background display worker for the e-Paper driver.
+#
+# A refresh holds the panel for tens of seconds. DisplayWorker runs them on
+# its own thread so the caller can keep fetching and rendering. Frames go
+# through a single latest-wins slot: while the panel is busy, each new frame
+# replaces the one waiting, so a burst of updates costs one more refresh,
+# not a backlog of them.
+
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class DisplayWorker:
+    def __init__(self, epd):
+        self.epd = epd
+        self._cond = threading.Condition()
+        self._pending = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='epd-display', daemon=True)
+        self._thread.start()
+
+    # Queue buf for EPD.refresh(buf, **kwargs) and return a Future for its
+    # result. callback, if given, is called with the Future once it is done.
+    # A frame still waiting when a newer one arrives is dropped, its Future
+    # is cancelled.
+    def submit(self, buf, callback=None, **kwargs):
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('DisplayWorker is closed')
+            if self._pending is not None:
+                logger.debug("Dropping a frame superseded before the panel was free")
+                self._pending[2].cancel()
+            self._pending = (buf, kwargs, future)
+            self._cond.notify()
+        return future
+
+    # Stop taking frames. The frame still waiting, if any, is shown first.
+    def close(self, wait=True):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if wait:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+                buf, kwargs, future = self._pending
+                self._pending = None
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.epd.refresh(buf, **kwargs))
+            except BaseException as e:
+                logger.error("Panel refresh failed: %s" % e)
+                future.set_exception(e)
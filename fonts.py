@@ -0,0 +1,51 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Process-wide font and text measurement caches for the render stage.
+#
+# get_font loads each (path, size, index) once, with relative paths taken
+# from the directory of this file rather than the working directory.
+# text_length and fit_text memoize font.getlength, so the labels and
+# values that repeat from one render to the next are only measured once.
+
+import os
+import functools
+
+from PIL import ImageFont
+
+FONT_DIR = os.path.dirname(os.path.realpath(__file__))
+# Bounds on the memoized measurements and fitted strings
+TEXT_CACHE_SIZE = 4096
+FIT_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=32)
+def _load_font(path, size, index):
+    return ImageFont.truetype(path, size, index=index)
+
+
+def get_font(path, size, index=0):
+    return _load_font(os.path.join(FONT_DIR, os.path.expanduser(path)), size, index)
+
+
+# Width of text in pixels when drawn with font
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def text_length(font, text):
+    return font.getlength(text)
+
+
+# The longest prefix of text, line by line, that is at most width pixels wide
+@functools.lru_cache(maxsize=FIT_CACHE_SIZE)
+def fit_text(font, text, width):
+    if '\n' in text:
+        return '\n'.join(fit_text(font, line, width) for line in text.split('\n'))
+    if text_length(font, text) <= width:
+        return text
+
+    low, high = 0, len(text) - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if text_length(font, text[:middle]) <= width:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Home Assistant websocket client that keeps a table of entity states.
+#
+# Instead of downloading /api/states every cycle, HassStream subscribes to
+# state changes of just the entities the dashboard shows and applies them
+# to an in-memory table as they happen. After every (re)connect the table
+# is rebuilt from a full REST sync, so nothing missed while the socket was
+# down lingers. The render loop reads the table through snapshot().
+
+import json
+import logging
+import threading
+
+from websockets.sync.client import connect
+
+from reconnect import run_with_reconnect
+
+logger = logging.getLogger(__name__)
+
+
+class HassAuthError(Exception):
+    pass
+
+
+class HassStream:
+    # url is the websocket endpoint, e.g. wss://host:8123/api/websocket.
+    # full_sync() returns a list of state objects (the /api/states JSON);
+    # only the ones in entity_ids are kept.
+    def __init__(self, url, token, entity_ids, full_sync, reconnect_delay=5, max_reconnect_delay=300):
+        self.url = url
+        self.token = token
+        self.entity_ids = frozenset(entity_ids)
+        self.full_sync = full_sync
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.states = {}
+        self.updates = 0
+        self.synced = threading.Event()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._ws = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='hass-stream', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        ws = self._ws
+        if ws is not None:
+            ws.close()
+        if self._thread is not None:
+            self._thread.join()
+
+    # The state objects currently known, in no particular order
+    def snapshot(self):
+        with self._lock:
+            return list(self.states.values())
+
+    def _run(self):
+        run_with_reconnect(self._session, self._stop, 'Home Assistant websocket',
+                           self.reconnect_delay, self.max_reconnect_delay,
+                           fatal=(HassAuthError,), on_drop=self._dropped)
+
+    def _dropped(self):
+        self._ws = None
+        self.synced.clear()
+
+    def _session(self):
+        with connect(self.url, open_timeout=10) as ws:
+            self._ws = ws
+            if self._stop.is_set():
+                return
+
+            message = json.loads(ws.recv())
+            if message.get('type') == 'auth_required':
+                ws.send(json.dumps({'type': 'auth', 'access_token': self.token}))
+                message = json.loads(ws.recv())
+            if message.get('type') != 'auth_ok':
+                raise HassAuthError(message.get('message', message.get('type')))
+
+            # Subscribe before syncing so no change falls between the two
+            ws.send(json.dumps({
+                'id': 1,
+                'type': 'subscribe_trigger',
+                'trigger': {'platform': 'state', 'entity_id': sorted(self.entity_ids)},
+            }))
+            message = json.loads(ws.recv())
+            if not message.get('success'):
+                raise ValueError(f'subscribe_trigger failed: {message.get("error")}')
+
+            states = {item['entity_id']: item for item in self.full_sync()
+                      if item['entity_id'] in self.entity_ids}
+            with self._lock:
+                self.states = states
+            self.synced.set()
+            logger.info(f'Home Assistant websocket synced {len(states)} entities.')
+
+            for raw in ws:
+                message = json.loads(raw)
+                if message.get('type') == 'event':
+                    self._apply(message['event']['variables']['trigger'])
+
+    def _apply(self, trigger):
+        entity_id = trigger['entity_id']
+        state = trigger.get('to_state')
+        with self._lock:
+            if state is None:
+                self.states.pop(entity_id, None)
+                return
+            # An event queued before the full sync can be older than it
+            current = self.states.get(entity_id)
+            if current is not None and current.get('last_updated', '') > state.get('last_updated', ''):
+                return
+            self.states[entity_id] = state
+            self.updates += 1
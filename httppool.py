@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Pooled HTTP sessions shared by every source the dashboard polls.
+#
+# One requests.Session per scheme://host:port keeps its connections alive,
+# so repeat requests to Home Assistant, Plex and the router skip the TCP
+# and TLS handshakes, within a cycle and across daemon cycles. Failed
+# connections and 502/503/504 answers are retried with exponential backoff.
+
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class SessionPool:
+    def __init__(self, pool_connections=2, pool_maxsize=4, retries=2, backoff_factor=0.5, timeout=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, url):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        with self._lock:
+            if key not in self._sessions:
+                retry = Retry(total=self.retries, backoff_factor=self.backoff_factor,
+                              status_forcelist=(502, 503, 504), raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                      pool_maxsize=self.pool_maxsize, max_retries=retry)
+                session = requests.Session()
+                session.mount(f'{parts.scheme}://', adapter)
+                self._sessions[key] = session
+                logger.debug(f'New HTTP session for {parts.scheme}://{parts.netloc}')
+            return self._sessions[key]
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session(url).request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    # Per host: requests sent, connections opened and how many requests
+    # went out on a connection that was already open.
+    def stats(self):
+        stats = {}
+        with self._lock:
+            sessions = list(self._sessions.items())
+        for (scheme, netloc), session in sessions:
+            opened = sent = 0
+            for adapter in session.adapters.values():
+                for key in adapter.poolmanager.pools.keys():
+                    pool = adapter.poolmanager.pools[key]
+                    opened += pool.num_connections
+                    sent += pool.num_requests
+            stats[netloc] = {'requests': sent, 'connections': opened, 'reused': max(sent - opened, 0)}
+        return stats
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Incremental reader for large JSON arrays of objects.
+#
+# Home Assistant's /api/states answers with one array holding every entity,
+# megabytes on a busy instance. json.loads on it keeps the whole text and
+# the whole decoded graph alive at once. iter_objects instead splits the
+# byte stream into the array's top-level objects as the chunks arrive, and
+# iter_matching decodes only the objects whose key is wanted, so peak
+# memory is one object plus the ones kept.
+
+import re
+import json
+
+# Outside a string only braces and whole strings matter. A quote with no
+# closing quote in the chunk starts a string that continues in the next
+# one, where only the closing quote and backslash escapes matter.
+_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}]|"')
+_STRING_END = re.compile(rb'["\\]')
+
+
+# Yield each top-level object of a JSON array as raw bytes. chunks is any
+# iterable of bytes, e.g. requests' iter_content(); objects may span chunks.
+def iter_objects(chunks):
+    depth = 0
+    in_string = False
+    escaped = False
+    parts = []
+    for chunk in chunks:
+        start = 0
+        pos = 0
+        end = len(chunk)
+        while pos < end:
+            if escaped:
+                escaped = False
+                pos += 1
+            elif in_string:
+                match = _STRING_END.search(chunk, pos)
+                if match is None:
+                    break
+                pos = match.end()
+                if chunk[match.start()] == 0x5c:
+                    escaped = True
+                else:
+                    in_string = False
+            else:
+                for match in _TOKEN.finditer(chunk, pos):
+                    token = match.group()
+                    if token == b'{':
+                        depth += 1
+                        if depth == 1:
+                            start = match.start()
+                    elif token == b'}':
+                        if depth:
+                            depth -= 1
+                            if depth == 0:
+                                parts.append(chunk[start:match.end()])
+                                yield b''.join(parts)
+                                parts = []
+                    elif token == b'"':
+                        in_string = True
+                        pos = match.end()
+                        break
+                else:
+                    pos = end
+        if depth:
+            parts.append(chunk[start:])
+
+
+# Yield the decoded objects whose string value for key is in values. The
+# key is matched on the raw bytes before decoding, so it has to come before
+# any nested object holding the same key, as entity_id does in Home
+# Assistant state objects.
+def iter_matching(chunks, key, values):
+    pattern = re.compile(rb'"' + re.escape(key.encode()) + rb'"\s*:\s*"((?:[^"\\]|\\.)*)"')
+    wanted = {value.encode() for value in values}
+    for raw in iter_objects(chunks):
+        match = pattern.search(raw)
+        if match is None or match.group(1) not in wanted:
+            continue
+        item = json.loads(raw)
+        if item.get(key) in values:
+            yield item
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Tile layout for the dashboard frame.
+#
+# The frame is split into tiles, each a box with a bounding box, an outline
+# color, the state fields it shows and a render function that draws those
+# fields in tile-local coordinates. Layout keeps every tile's last inputs
+# and the composited frame, so a render only redraws the tiles whose fields
+# changed and reports their boxes as the dirty rectangles.
+
+import logging
+import types
+from collections import namedtuple
+
+from PIL import Image, ImageDraw
+
+import fonts
+
+logger = logging.getLogger(__name__)
+
+# bbox is (left, top, right, bottom) with right and bottom exclusive.
+# render(canvas, fields) gets a TileCanvas and a namespace holding only the
+# tile's fields.
+Tile = namedtuple('Tile', 'name bbox outline fields render')
+
+
+class TileCanvas:
+    def __init__(self, image, font, margin):
+        self.image = image
+        self.draw = ImageDraw.Draw(image)
+        self.font = font
+        self.margin = margin
+
+    # Draw text at xy, every line cut to the width left in the tile
+    def text(self, xy, s, fill=0):
+        width = self.image.width - xy[0] - self.margin
+        self.draw.text(xy, fonts.fit_text(self.font, s, width), font=self.font, fill=fill)
+
+    # Draw s on line y, ending margin pixels short of the tile's right edge
+    def text_right(self, y, s, fill=0):
+        x = self.image.width - self.margin - fonts.text_length(self.font, s)
+        self.draw.text((x, y), s, font=self.font, fill=fill)
+
+
+class Layout:
+    def __init__(self, size, tiles, background=0xffffff, margin=4):
+        self.size = size
+        self.tiles = tiles
+        self.background = background
+        self.margin = margin
+        self.frame = Image.new('RGB', size, background)
+        self._inputs = {}
+
+    # Drop every tile's cached inputs so the next render redraws them all
+    def invalidate(self):
+        self._inputs = {}
+
+    # Bring the frame up to date with state (any object holding the tiles'
+    # fields as attributes, missing ones read as None). Returns the frame,
+    # which is kept and updated by later renders, and the bboxes of the
+    # tiles that were redrawn.
+    def render(self, state, font):
+        dirty = []
+        for tile in self.tiles:
+            values = tuple(getattr(state, field, None) for field in tile.fields)
+            inputs = (font,) + values
+            if self._inputs.get(tile.name) == inputs:
+                continue
+
+            left, top, right, bottom = tile.bbox
+            image = Image.new('RGB', (right - left, bottom - top), self.background)
+            canvas = TileCanvas(image, font, self.margin)
+            # The outline's right and bottom edges run on the first column and
+            # row past the tile, where the neighbour draws its own left and top
+            # edges, so neighbours share one separator. At the frame's edge the
+            # outline stays inside.
+            outline = (0, 0, min(right, self.size[0] - 1) - left, min(bottom, self.size[1] - 1) - top)
+            canvas.draw.rounded_rectangle(outline, outline=tile.outline, width=2)
+            tile.render(canvas, types.SimpleNamespace(**dict(zip(tile.fields, values))))
+
+            self.frame.paste(image, (left, top))
+            self._inputs[tile.name] = inputs
+            dirty.append(tile.bbox)
+
+        logger.debug(f'Redrew {len(dirty)} of {len(self.tiles)} tiles')
+        return self.frame, dirty
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Plex notification websocket listener that keeps the "now playing" list.
+#
+# Plex pushes a `playing` notification for every session on start, stop,
+# pause and every few seconds of progress, but without the titles and users
+# the dashboard shows. PlexSessions keeps a table of the live session keys
+# from those events and only asks fetch_streams() for the full list when a
+# session starts or stops. on_change() is called when that list differs
+# from the one before. After every (re)connect the list is fetched again,
+# and snapshot() is only trusted while synced is set.
+
+import json
+import logging
+import threading
+
+from websockets.sync.client import connect
+
+from reconnect import run_with_reconnect
+
+logger = logging.getLogger(__name__)
+
+
+class PlexSessions:
+    def __init__(self, url, token, fetch_streams, on_change=None, reconnect_delay=5, max_reconnect_delay=300):
+        self.url = url
+        self.token = token
+        self.fetch_streams = fetch_streams
+        self.on_change = on_change
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.sessions = {}
+        self.streams = []
+        self.synced = threading.Event()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._ws = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='plex-sessions', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        ws = self._ws
+        if ws is not None:
+            ws.close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.streams)
+
+    def _run(self):
+        run_with_reconnect(self._session, self._stop, 'Plex notification websocket',
+                           self.reconnect_delay, self.max_reconnect_delay, on_drop=self._dropped)
+
+    def _dropped(self):
+        self._ws = None
+        self.synced.clear()
+
+    def _session(self):
+        with connect(self.url, additional_headers={'X-Plex-Token': self.token}, open_timeout=10) as ws:
+            self._ws = ws
+            if self._stop.is_set():
+                return
+
+            # Events arriving during the fetch are queued on the socket, so
+            # the table can start empty and fill from the next ones
+            self.sessions = {}
+            self._update_streams()
+            self.synced.set()
+            logger.info('Plex notification websocket connected.')
+
+            for raw in ws:
+                container = json.loads(raw).get('NotificationContainer', {})
+                if container.get('type') == 'playing':
+                    self._apply(container.get('PlaySessionStateNotification', []))
+
+    def _apply(self, notifications):
+        before = set(self.sessions)
+        for notification in notifications:
+            key = notification.get('sessionKey')
+            if notification.get('state') == 'stopped':
+                self.sessions.pop(key, None)
+            else:
+                self.sessions[key] = notification.get('state')
+        # Progress and pause/resume events do not change what is shown
+        if set(self.sessions) != before:
+            self._update_streams()
+
+    def _update_streams(self):
+        streams = self.fetch_streams()
+        with self._lock:
+            changed = streams != self.streams
+            self.streams = streams
+        if changed and self.synced.is_set() and self.on_change is not None:
+            self.on_change()
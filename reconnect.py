@@ -0,0 +1,34 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Reconnect loop shared by the websocket listeners.
+#
+# run_with_reconnect calls session() over and over until stop is set. A
+# session that returns normally reconnects after reconnect_delay; one that
+# raises is logged and retried after a delay that doubles up to
+# max_reconnect_delay. Anything can go wrong between connects (DNS, TLS,
+# a 502 from a proxy during the handshake, a bad message), so every
+# exception is retried except the ones in fatal, which end the loop.
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# on_drop() runs after every session, however it ended
+def run_with_reconnect(session, stop, name, reconnect_delay, max_reconnect_delay, fatal=(), on_drop=None):
+    delay = reconnect_delay
+    while not stop.is_set():
+        try:
+            session()
+            delay = reconnect_delay
+        except fatal as e:
+            logger.error(f'{name} failed, giving up: {e}')
+            return
+        except Exception as e:
+            logger.warning(f'{name} dropped: {e!r}')
+        finally:
+            if on_drop is not None:
+                on_drop()
+        if stop.wait(delay):
+            return
+        delay = min(delay * 2, max_reconnect_delay)
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# On-disk cache for responses from slow moving or rate limited sources.
+#
+# Each entry holds the body of one response with its ETag/Last-Modified and
+# when it was stored. get() answers from the entry while it is fresh (ttl),
+# answers from it and revalidates in the background while it is stale
+# (ttl + stale), and only waits on the network after that. Revalidation
+# sends If-None-Match/If-Modified-Since, a 304 just renews the entry. When
+# the source fails, or answers 429 or a 5xx, the entry is served instead as
+# long as it is younger than ttl + stale + stale_if_error, and the caller's
+# on_error is told so it can flag the data as stale. At most max_entries
+# are kept, least recently used go first.
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    # With directory None nothing is cached and every get() fetches
+    def __init__(self, directory, max_entries=64):
+        self.directory = os.path.expanduser(directory) if directory else None
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._revalidating = set()
+        # Keys whose last revalidation failed, with what went wrong
+        self._errors = {}
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+    # Returns (meta, body), or None if there is no entry. An entry is one
+    # line of JSON metadata followed by the body.
+    def load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(key), 'rb') as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+            # The file's mtime is when it was last used, for eviction
+            os.utime(self.path(key))
+        except (OSError, ValueError):
+            return None
+        if meta.get('key') != key:
+            return None
+        return meta, body
+
+    # Keep response as the entry for key. parse(response), if given, makes
+    # the body that is kept, else it is the whole content. Returns the body.
+    def store(self, key, response, parse=None):
+        body = response.content if parse is None else parse(response)
+        if self.directory is not None:
+            meta = {
+                'key': key,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+            self.write(key, meta, body)
+            self.evict()
+        return body
+
+    def write(self, key, meta, body):
+        if self.directory is None:
+            return
+        meta = dict(meta, stored=time.time())
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(meta).encode() + b'\n')
+            f.write(body)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.stat(path).st_mtime, path))
+                except FileNotFoundError:
+                    pass
+            entries.sort()
+            for _, path in entries[:max(len(entries) - self.max_entries, 0)]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    # Body (bytes) of the response for key. fetch(headers) sends the request
+    # with the extra conditional headers and returns the requests.Response.
+    # on_error(error) is called whenever the body returned stands in for a
+    # fetch that failed, now or in the last background revalidation. Raises
+    # what fetch raised, or requests.HTTPError, when there is no entry young
+    # enough to fall back on. With parse, the entry holds parse(response)
+    # rather than the response body, so fetch may stream the response.
+    def get(self, key, fetch, ttl, stale=0, stale_if_error=0, on_error=None, parse=None):
+        max_age = ttl + stale + stale_if_error
+        entry = self.load(key)
+        if entry is not None:
+            meta, body = entry
+            age = time.time() - meta['stored']
+            if age < ttl + stale:
+                error = self._errors.get(key)
+                if error is not None and on_error is not None:
+                    on_error(error)
+                if age >= ttl:
+                    self.revalidate_later(key, fetch, entry, max_age, parse)
+                return body
+        return self.revalidate(key, fetch, entry, max_age, on_error, parse)
+
+    def revalidate(self, key, fetch, entry, max_age, on_error=None, parse=None):
+        fallback = entry
+        if entry is not None and time.time() - entry[0]['stored'] >= max_age:
+            fallback = None
+
+        headers = {}
+        if entry is not None:
+            meta, body = entry
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            response = fetch(headers)
+        except requests.RequestException as e:
+            if fallback is None:
+                raise
+            return self.fall_back(key, fallback, repr(e), on_error)
+
+        with response:
+            if response.status_code == 304 and entry is not None:
+                self.write(key, *entry)
+                self._errors.pop(key, None)
+                return entry[1]
+            if response.ok:
+                body = self.store(key, response, parse)
+                self._errors.pop(key, None)
+                return body
+            if fallback is not None and (response.status_code == 429 or response.status_code >= 500):
+                return self.fall_back(key, fallback, f'HTTP {response.status_code}', on_error)
+            response.raise_for_status()
+            return response.content
+
+    def fall_back(self, key, entry, error, on_error):
+        logger.warning(f'Serving cached {key}: {error}')
+        self._errors[key] = error
+        if on_error is not None:
+            on_error(error)
+        return entry[1]
+
+    # Revalidate on a thread of its own, once per key at a time. The thread
+    # is not a daemon so a one-shot run still finishes it before exiting.
+    def revalidate_later(self, key, fetch, entry, max_age, parse=None):
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def run():
+            try:
+                self.revalidate(key, fetch, entry, max_age, parse=parse)
+            except Exception as e:
+                logger.warning(f'Revalidating {key} failed: {e!r}')
+                self._errors[key] = repr(e)
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        threading.Thread(target=run, name='cache-revalidate').start()
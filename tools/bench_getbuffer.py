@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Micro-benchmark for the 4 bit pixel packer used by EPD.getbuffer.
+#
+# Compares the original per-pixel loop with epd5in65f.pack_pixels (and its
+# pure bytes fallback when NumPy is installed) on a synthetic quantized
+# frame, and checks that every packer produces identical output. Then times
+# a whole EPD.getbuffer against one that only converts the dirty regions of
+# a typical update, and checks both give the same buffer.
+#
+#   python tools/bench_getbuffer.py [--repeat N]
+
+import os
+import sys
+import random
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+os.environ.setdefault('EPD_BACKEND', 'virtual')
+
+from PIL import Image
+
+import epd5in65f
+
+
+def pack_pixels_loop(buf_7color):
+    # The packer EPD.getbuffer used before pack_pixels, kept as the reference.
+    buf = [0x00] * int(len(buf_7color) / 2)
+    idx = 0
+    for i in range(0, len(buf_7color), 2):
+        buf[idx] = (buf_7color[i] << 4) + buf_7color[i+1]
+        idx += 1
+    return buf
+
+
+def pack_pixels_bytes(buf_7color):
+    # pack_pixels with NumPy hidden, to time the pure bytes fallback.
+    saved, epd5in65f.numpy = epd5in65f.numpy, None
+    try:
+        return epd5in65f.pack_pixels(buf_7color)
+    finally:
+        epd5in65f.numpy = saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the getbuffer pixel packers.")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    # A quantized frame holds one palette index (0-6) per pixel.
+    rng = random.Random(0)
+    frame = bytes(rng.randrange(7) for _ in range(epd5in65f.EPD_WIDTH * epd5in65f.EPD_HEIGHT))
+
+    packers = [('loop', pack_pixels_loop), ('bytes', pack_pixels_bytes)]
+    if epd5in65f.numpy is not None:
+        packers.append(('numpy', epd5in65f.pack_pixels))
+
+    reference = bytes(pack_pixels_loop(frame))
+    baseline = None
+    for name, packer in packers:
+        if bytes(packer(frame)) != reference:
+            print(f'{name}: output differs from the reference packer')
+            sys.exit(1)
+        best = min(timeit.repeat(lambda: packer(frame), number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print(f'{name:>6}: {best * 1000:9.2f} ms  ({baseline / best:7.1f}x)')
+
+    bench_regions(args.repeat)
+
+
+# Dirty regions of an update where only the Plex tile and the clock changed
+REGIONS = [(200, 220, 400, 448), (2, 2, 183, 20)]
+
+
+def bench_regions(repeat):
+    rng = random.Random(1)
+    image = Image.new('RGB', (epd5in65f.EPD_WIDTH, epd5in65f.EPD_HEIGHT), (255, 255, 255))
+    for _ in range(400):
+        x, y = rng.randrange(590), rng.randrange(438)
+        image.paste(tuple(rng.randrange(256) for _ in range(3)), (x, y, x + 10, y + 10))
+    changed = image.copy()
+    for box in REGIONS:
+        changed.paste((0, 0, 255), box)
+
+    for mode in ('nearest', 'ordered'):
+        full = epd5in65f.EPD()
+        incremental = epd5in65f.EPD()
+        incremental.getbuffer(image, mode)
+        if incremental.getbuffer(changed, mode, regions=REGIONS) != full.getbuffer(changed, mode):
+            print(f'{mode}: region update differs from a full conversion')
+            sys.exit(1)
+        whole = min(timeit.repeat(lambda: full.getbuffer(changed, mode), number=1, repeat=repeat))
+        regions = min(timeit.repeat(lambda: incremental.getbuffer(changed, mode, regions=REGIONS),
+                                    number=1, repeat=repeat))
+        print(f'{mode:>8}: full {whole * 1000:7.2f} ms  regions {regions * 1000:7.2f} ms  ({whole / regions:5.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# End to end refresh benchmark on the virtual epdconfig backend.
+#
+# Renders a synthetic dashboard-like frame and pushes it through
+# getbuffer and EPD.refresh, reporting the time spent converting the frame,
+# transferring it and waiting on the modelled BUSY line.
+#
+#   python tools/bench_refresh.py [--cycles N] [--scale S] [--output frame.png]
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+os.environ.setdefault('EPD_BACKEND', 'virtual')
+
+from PIL import Image, ImageDraw
+
+import epd5in65f
+import epdconfig
+
+
+def synthetic_frame(epd, cycle):
+    image = Image.new('RGB', (epd.width, epd.height), 0xffffff)
+    draw = ImageDraw.Draw(image)
+    colors = (epd.ORANGE, epd.GREEN, epd.BLUE, epd.BLUE, epd.RED, epd.YELLOW)
+    for i, color in enumerate(colors):
+        x, y = (i % 3) * 200, (i // 3) * 220
+        draw.rounded_rectangle((x, y, x + 199, y + 227), outline=color, width=2)
+        for line in range(10):
+            draw.text((x + 4, y + 2 + line * 20), f'Line {line} of box {i}, cycle {cycle}', fill=0)
+    return image
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark refreshes on the virtual panel.')
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--scale', type=float, default=0.0,
+                        help='time scale for modelled delays, 1 is real time')
+    parser.add_argument('--mode', default='nearest')
+    parser.add_argument('--output', help='write the last decoded frame to this PNG')
+    args = parser.parse_args()
+
+    backend = epdconfig.implementation
+    backend.time_scale = args.scale
+    epd = epd5in65f.EPD(keep_open=True)
+
+    for cycle in range(args.cycles):
+        image = synthetic_frame(epd, cycle)
+        start = time.perf_counter()
+        buf = epd.getbuffer(image, mode=args.mode)
+        converted = time.perf_counter()
+        epd.refresh(buf)
+        done = time.perf_counter()
+        busy = sum(epd.busy_times.values())
+        print(f'cycle {cycle}: getbuffer {(converted - start) * 1000:8.2f} ms  '
+              f'refresh {(done - converted) * 1000:9.2f} ms  (busy {busy * 1000:9.2f} ms)')
+
+    print(f'{backend.frames} frames, {backend.spi_calls} SPI calls, '
+          f'{backend.spi_bytes} bytes, {backend.gpio_calls} GPIO calls')
+    epd.shutdown()
+    if args.output:
+        backend.render().save(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Cold start benchmark for app.py, to catch import time regressions.
+#
+# Imports the app in fresh interpreters with -X importtime and reports the
+# wall time, the cumulative import time of app and the slowest imports it
+# pulled in. With --budget-ms the script fails when the median cumulative
+# import time of app goes over the budget.
+#
+#   python tools/bench_startup.py [--runs N] [--top N] [--budget-ms MS]
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def import_once(module):
+    env = dict(os.environ)
+    env.setdefault('EPD_BACKEND', 'virtual')
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - start
+
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.rstrip()))
+    return wall, imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the cold start of the app.')
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float)
+    args = parser.parse_args()
+
+    walls, totals = [], []
+    for _ in range(args.runs):
+        wall, imports = import_once(args.module)
+        walls.append(wall)
+        totals.append(next(us for us, name in imports if name.strip() == args.module))
+
+    total_ms = statistics.median(totals) / 1000.0
+    print(f'interpreter + import {args.module}: {statistics.median(walls) * 1000:8.2f} ms (median of {args.runs})')
+    print(f'import {args.module} cumulative:   {total_ms:8.2f} ms')
+    print(f'slowest imports of the last run:')
+    for us, name in sorted(imports, reverse=True)[:args.top]:
+        print(f'  {us / 1000.0:8.2f} ms {name}')
+
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f'import {args.module} takes {total_ms:.2f} ms, over the {args.budget_ms:.2f} ms budget')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Peak memory and time of parsing a Home Assistant /api/states payload.
+#
+# Compares the old path, which joins the response, decodes it to text and
+# runs json.loads on all of it, with jsonstream.iter_matching over the
+# chunks as they arrive. The payload is a synthetic states array of
+# --entities entities (the dashboard's own among them), produced chunk by
+# chunk like a socket would, so neither path starts with it in memory.
+# Both must keep the same state objects.
+#
+#   python tools/bench_states_parse.py [--entities N] [--chunk-size N]
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+os.environ.setdefault('EPD_BACKEND', 'virtual')
+
+import app
+import jsonstream
+
+
+def make_states(count):
+    states = [{
+        'entity_id': entity_id,
+        'state': '42',
+        'attributes': {name: '1' for name in entity.attributes},
+        'last_changed': '2024-01-01T00:00:00.000000+00:00',
+        'last_updated': '2024-01-01T00:00:00.000000+00:00',
+        'context': {'id': '01HKZ', 'parent_id': None, 'user_id': None},
+    } for entity_id, entity in app.ENTITIES.items()]
+    for i in range(count - len(states)):
+        states.insert(i * 7 % (len(states) + 1), {
+            'entity_id': f'sensor.unrelated_{i}',
+            'state': 'on',
+            'attributes': {'friendly_name': f'Unrelated {i}', 'entity_id': ['sensor.a', 'sensor.b'],
+                           'history': [{'t': n, 'v': 'x' * 20} for n in range(8)]},
+            'last_changed': '2024-01-01T00:00:00.000000+00:00',
+            'last_updated': '2024-01-01T00:00:00.000000+00:00',
+            'context': {'id': '01HKZ', 'parent_id': None, 'user_id': None},
+        })
+    return states
+
+
+def chunked(states, size):
+    # Serialize lazily and cut the bytes into fixed size chunks
+    pending = b'['
+    for i, item in enumerate(states):
+        pending += (b',' if i else b'') + json.dumps(item).encode()
+        while len(pending) >= size:
+            yield pending[:size]
+            pending = pending[size:]
+    yield pending + b']'
+
+
+def load_whole(chunks):
+    content = b''.join(chunks)
+    text = content.decode('utf-8')
+    return [item for item in json.loads(text) if item['entity_id'] in app.ENTITIES]
+
+
+def load_streamed(chunks):
+    return list(jsonstream.iter_matching(chunks, 'entity_id', app.ENTITIES))
+
+
+def measure(loader, states, size):
+    # Timed untraced, since tracemalloc slows allocation heavy code unevenly
+    started = time.perf_counter()
+    loader(chunked(states, size))
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    kept = loader(chunked(states, size))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return kept, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure peak memory of parsing /api/states.')
+    parser.add_argument('--entities', type=int, default=3000)
+    parser.add_argument('--chunk-size', type=int, default=app.STATES_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    states = make_states(args.entities)
+    size = sum(len(chunk) for chunk in chunked(states, args.chunk_size))
+    print(f'payload: {len(states)} entities, {size / 1024:.0f} KiB')
+
+    results = {}
+    for name, loader in (('json.loads', load_whole), ('streamed', load_streamed)):
+        kept, elapsed, peak = measure(loader, states, args.chunk_size)
+        results[name] = kept
+        print(f'{name:>10}: kept {len(kept):3d}  peak {peak / 1024:8.0f} KiB  {elapsed * 1000:7.1f} ms')
+
+    if results['json.loads'] != results['streamed']:
+        print('streamed parser kept different states')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Compares the per-byte send_command/send_data path with the batched
+# send_transaction path for the init, resolution and sleep register tables.
+#
+# Runs on the virtual epdconfig backend, which captures the command/data
+# stream and charges a configurable cost for every GPIO or SPI call, to
+# stand in for the gpiozero and spidev round-trips of the real hardware.
+#
+#   python tools/bench_transactions.py [--call-cost-us N] [--repeat N]
+
+import os
+import sys
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+os.environ.setdefault('EPD_BACKEND', 'virtual')
+
+import epd5in65f
+import epdconfig
+
+SEQUENCES = epd5in65f.INIT_SEQUENCE + epd5in65f.INIT_SETTLE_SEQUENCE + \
+    epd5in65f.RESOLUTION_SEQUENCE + epd5in65f.SLEEP_SEQUENCE
+
+
+def per_byte(epd):
+    for command, data in SEQUENCES:
+        epd.send_command(command)
+        for b in data:
+            epd.send_data(b)
+
+
+def batched(epd):
+    epd.send_sequence(SEQUENCES)
+
+
+def run(path):
+    backend = epdconfig.implementation
+    backend.module_init()
+    backend.spi_calls = backend.gpio_calls = 0
+    path(epd5in65f.EPD())
+    return backend.spi_calls + backend.gpio_calls, list(backend.transactions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-byte and batched register writes.')
+    parser.add_argument('--call-cost-us', type=float, default=50.0,
+                        help='modelled cost of one GPIO or SPI call in microseconds')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    backend = epdconfig.implementation
+    backend.timing['call_us'] = args.call_cost_us
+    backend.time_scale = 1.0
+
+    streams = {}
+    for name, path in (('per-byte', per_byte), ('batched', batched)):
+        calls, streams[name] = run(path)
+        best = min(timeit.repeat(lambda: run(path), number=1, repeat=args.repeat))
+        print(f'{name:>8}: {calls:4d} backend calls  {best * 1000:8.2f} ms')
+
+    if streams['per-byte'] != streams['batched']:
+        print('batched path sends a different command/data stream')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
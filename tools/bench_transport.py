@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Peak memory and transfer time of the frame transport, before and after
+# the move to buffer objects.
+#
+# 'list' sends frames the old way: getbuffer's output as a list of ints and
+# a freshly allocated list for every Clear. 'buffer' sends the bytes from
+# getbuffer and the shared WHITE_FRAME. Each mode runs in its own
+# interpreter on the virtual backend so peak RSS is not shared.
+#
+#   python tools/bench_transport.py [--cycles N]
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tracemalloc
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def run(mode, cycles):
+    sys.path.insert(0, ROOT)
+    os.environ['EPD_BACKEND'] = 'virtual'
+    import epd5in65f
+    import epdconfig
+
+    epdconfig.implementation.time_scale = 0
+    epd = epd5in65f.EPD()
+    rng = random.Random(0)
+    packed = bytes(rng.randrange(256) for _ in range(len(epd5in65f.WHITE_FRAME)))
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(cycles):
+        # Drop the virtual panel's capture so it does not pile up
+        epdconfig.implementation.module_init()
+        if mode == 'list':
+            epd.send_frame(list(packed))
+            epd.send_frame([0x11] * int(epd.width * epd.height / 2))
+        else:
+            epd.send_frame(packed)
+            epd.send_frame(epd5in65f.WHITE_FRAME)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {
+        'transfer_ms': elapsed / (cycles * 2) * 1000,
+        'traced_peak_kb': peak / 1024,
+        'maxrss_kb': rss_after,
+        'maxrss_growth_kb': rss_after - rss_before,
+        'spi_calls': epdconfig.implementation.spi_calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark frame transport memory and time.')
+    parser.add_argument('--cycles', type=int, default=10)
+    parser.add_argument('--child', choices=('list', 'buffer'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run(args.child, args.cycles)))
+        return
+
+    for mode in ('list', 'buffer'):
+        out = subprocess.run([sys.executable, __file__, '--child', mode, '--cycles', str(args.cycles)],
+                             capture_output=True, text=True, check=True).stdout
+        r = json.loads(out)
+        print(f"{mode:>6}: {r['transfer_ms']:7.2f} ms per frame  "
+              f"traced peak {r['traced_peak_kb']:8.1f} KiB  "
+              f"max RSS {r['maxrss_kb']} KiB (+{r['maxrss_growth_kb']} KiB in the loop)  "
+              f"{r['spi_calls']} SPI calls")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# Local stand-in for the parts of Home Assistant the dashboard talks to.
+#
+# Serves GET /api/states over plain HTTP and the websocket API on
+# /api/websocket (auth, subscribe_trigger on state platforms, trigger
+# events) from one port, with a state table that can be changed at runtime.
+# Use it to exercise hass.HassStream and the REST paths without a real
+# instance, either from the command line or imported:
+#
+#   standin = HassStandin(token='t', states=[...])
+#   standin.start()                      # picks a free port
+#   standin.set_state('switch.fan', 'on')
+#   standin.stop()
+#
+#   python tools/hass_standin.py [--port 8123] [--token T] [--states states.json] [--churn S]
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timezone
+from http import HTTPStatus
+
+from websockets.datastructures import Headers
+from websockets.exceptions import ConnectionClosed
+from websockets.http11 import Response
+from websockets.sync.server import serve
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class HassStandin:
+    def __init__(self, token='standin-token', states=(), host='127.0.0.1', port=0):
+        self.token = token
+        self.host = host
+        self.port = port
+        self.states = {item['entity_id']: item for item in states}
+        self.rest_requests = 0
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._server = None
+        self._thread = None
+
+    @property
+    def http_url(self):
+        return f'http://{self.host}:{self.port}/'
+
+    @property
+    def ws_url(self):
+        return f'ws://{self.host}:{self.port}/api/websocket'
+
+    def start(self):
+        self._server = serve(self._handle, self.host, self.port, process_request=self._process_request)
+        self.port = self._server.socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='hass-standin', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._thread.join()
+
+    # Change an entity and push the change to every subscriber following it
+    def set_state(self, entity_id, state, attributes=None):
+        with self._lock:
+            old = self.states.get(entity_id)
+            if attributes is None:
+                attributes = dict(old['attributes']) if old else {}
+            stamp = now()
+            new = {'entity_id': entity_id, 'state': state, 'attributes': attributes,
+                   'last_changed': stamp, 'last_updated': stamp}
+            self.states[entity_id] = new
+            subscribers = list(self._subscribers)
+
+        for ws, subscription, entity_ids in subscribers:
+            if entity_id not in entity_ids:
+                continue
+            event = {'id': subscription, 'type': 'event', 'event': {'variables': {'trigger': {
+                'platform': 'state', 'entity_id': entity_id, 'from_state': old, 'to_state': new}}}}
+            try:
+                ws.send(json.dumps(event))
+            except ConnectionClosed:
+                pass
+
+    # Drop every websocket client, as a restart of Home Assistant would
+    def disconnect_all(self):
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for ws, _, _ in subscribers:
+            ws.close()
+
+    def _process_request(self, connection, request):
+        if request.path != '/api/states':
+            return None
+        if request.headers.get('Authorization') != f'Bearer {self.token}':
+            return connection.respond(HTTPStatus.UNAUTHORIZED, '401: Unauthorized\n')
+        with self._lock:
+            self.rest_requests += 1
+            body = json.dumps(list(self.states.values())).encode()
+        headers = Headers([('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+        return Response(HTTPStatus.OK, 'OK', headers, body)
+
+    def _handle(self, ws):
+        ws.send(json.dumps({'type': 'auth_required', 'ha_version': 'standin'}))
+        message = json.loads(ws.recv())
+        if message.get('type') != 'auth' or message.get('access_token') != self.token:
+            ws.send(json.dumps({'type': 'auth_invalid', 'message': 'Invalid access token'}))
+            return
+        ws.send(json.dumps({'type': 'auth_ok', 'ha_version': 'standin'}))
+
+        try:
+            for raw in ws:
+                message = json.loads(raw)
+                trigger = message.get('trigger', {})
+                if message.get('type') == 'subscribe_trigger' and trigger.get('platform') == 'state':
+                    entity_ids = trigger['entity_id']
+                    if isinstance(entity_ids, str):
+                        entity_ids = [entity_ids]
+                    with self._lock:
+                        self._subscribers.append((ws, message['id'], frozenset(entity_ids)))
+                    ws.send(json.dumps({'id': message['id'], 'type': 'result', 'success': True, 'result': None}))
+                else:
+                    ws.send(json.dumps({'id': message.get('id'), 'type': 'result', 'success': False,
+                                        'error': {'code': 'unknown_command', 'message': 'Unknown command.'}}))
+        finally:
+            with self._lock:
+                self._subscribers = [s for s in self._subscribers if s[0] is not ws]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local Home Assistant stand-in.')
+    parser.add_argument('--port', type=int, default=8123)
+    parser.add_argument('--token', default='standin-token')
+    parser.add_argument('--states', help='JSON file in the /api/states format')
+    parser.add_argument('--churn', type=float, default=0,
+                        help='change a random numeric entity every CHURN seconds')
+    args = parser.parse_args()
+
+    states = []
+    if args.states:
+        with open(args.states) as f:
+            states = json.load(f)
+    standin = HassStandin(args.token, states, host='0.0.0.0', port=args.port)
+    standin.start()
+    print(f'Home Assistant stand-in on port {standin.port}, token {args.token}', file=sys.stderr)
+
+    try:
+        while True:
+            if not args.churn:
+                time.sleep(3600)
+                continue
+            time.sleep(args.churn)
+            numeric = [item for item in standin.states.values() if item['state'].replace('.', '', 1).isdigit()]
+            if numeric:
+                item = random.choice(numeric)
+                standin.set_state(item['entity_id'], str(round(float(item['state']) * random.uniform(0.9, 1.1), 2)))
+    except KeyboardInterrupt:
+        standin.stop()
+
+
+if __name__ == '__main__':
+    main()